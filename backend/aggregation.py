@@ -0,0 +1,227 @@
+import multiprocessing
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from datetime import datetime, timedelta
+from typing import Any, Callable, Dict, List, Optional
+
+import numpy as np
+
+
+# Inputs with fewer rows than this are aggregated inline, where pool overhead would dominate;
+# closed positions are fetched in one call of at most 5000 rows, so the default must stay below that
+INLINE_MAX_ROWS = int(os.getenv("AGGREGATION_INLINE_MAX_ROWS", "4000"))
+POOL_WORKERS = int(os.getenv("AGGREGATION_WORKERS", str(min(4, os.cpu_count() or 1))))
+
+
+def date_key(timestamp: float, granularity: str = 'daily') -> str:
+    dt = datetime.fromtimestamp(timestamp) if timestamp > 0 else datetime.now()
+    fmt = '%Y-%m-%d' if granularity == 'daily' else '%Y-%m'
+    return dt.strftime(fmt)
+
+
+def to_float(value: Any) -> float:
+    if isinstance(value, str):
+        try:
+            return float(value)
+        except ValueError:
+            return 0.0
+    return float(value) if value else 0.0
+
+
+def row_size(item: Dict[str, Any]) -> float:
+    size = item.get('size') or item.get('shares') or item.get('quantity') or item.get('amount') or 0
+    if 'sharesNum' in item:
+        try:
+            return float(item['sharesNum'])
+        except (ValueError, TypeError):
+            pass
+    return to_float(size)
+
+
+def row_avg_price(position: Dict[str, Any]) -> float:
+    return to_float(position.get('avgPrice') or position.get('averagePrice') or position.get('costBasis') or 0)
+
+
+def row_current_price(position: Dict[str, Any]) -> float:
+    return to_float(position.get('curPrice') or position.get('currentPrice') or position.get('price') or 0)
+
+
+def row_timestamp(item: Dict[str, Any]) -> int:
+    timestamp = item.get('timestamp') or item.get('createdAt') or item.get('created') or 0
+
+    if isinstance(timestamp, str):
+        try:
+            return int(timestamp) if timestamp.isdigit() else int(datetime.fromisoformat(timestamp.replace('Z', '+00:00')).timestamp())
+        except (ValueError, AttributeError):
+            return 0
+
+    if isinstance(timestamp, (int, float)):
+        return int(timestamp / 1000) if timestamp > 1e10 else int(timestamp)
+
+    return 0
+
+
+def closed_position_pnl(closed_pos: Dict[str, Any]) -> float:
+    # Prefer source PnL if present (assumed dollars)
+    pnl_value = (closed_pos.get('pnl') or closed_pos.get('realizedPnl') or
+                 closed_pos.get('cashPnl') or closed_pos.get('profit') or
+                 closed_pos.get('realized_pnl') or closed_pos.get('cash_pnl'))
+
+    if pnl_value is None:
+        # Recompute in dollars if needed (prices 0–1 or dollar prices both fine)
+        size = row_size(closed_pos)
+        avg_price = row_avg_price(closed_pos)
+        sell_price = (row_current_price(closed_pos) or
+                      closed_pos.get('sellPrice') or
+                      closed_pos.get('closePrice') or 0)
+        if size is not None and avg_price is not None and sell_price is not None:
+            pnl_value = (float(sell_price) - float(avg_price)) * float(size)
+        else:
+            pnl_value = 0.0
+
+    return to_float(pnl_value)
+
+
+def aggregate_pnl_history(closed_positions: List[Dict[str, Any]], unrealized_pnl: float,
+                          granularity: str, now: float) -> Dict[str, Any]:
+    """
+    Bucket realized PnL of raw closed-position rows by period and add today's
+    unrealized PnL. Parses the rows itself, so all of the per-row work happens
+    wherever this runs.
+    """
+    pnl = np.array([closed_position_pnl(p) for p in closed_positions], dtype=np.float64)
+    timestamps = np.array([row_timestamp(p) for p in closed_positions], dtype=np.int64)
+    timestamps = np.where(timestamps > 0, timestamps, int(now))
+    period_realized_pnl: Dict[str, float] = {}
+
+    # Format each distinct timestamp once instead of once per row
+    unique_ts, inverse = np.unique(timestamps, return_inverse=True)
+    sums = np.bincount(inverse, weights=pnl, minlength=len(unique_ts))
+    for ts, value in zip(unique_ts.tolist(), sums.tolist()):
+        key = date_key(ts, granularity)
+        period_realized_pnl[key] = period_realized_pnl.get(key, 0.0) + value
+
+    if unrealized_pnl != 0.0:
+        today_key = date_key(now, granularity)
+        period_realized_pnl[today_key] = period_realized_pnl.get(today_key, 0.0) + unrealized_pnl
+
+    all_periods = sorted(period_realized_pnl.keys())
+    cumulative_pnl = 0.0
+    pnl_data = []
+
+    if not all_periods and granularity == 'daily':
+        today = datetime.fromtimestamp(now)
+        pnl_data = [{
+            'date': (today - timedelta(days=i)).strftime('%Y-%m-%d'),
+            'pnl': 0.0,
+            'cumulativePnL': 0.0
+        } for i in range(29, -1, -1)]
+    else:
+        for period in all_periods:
+            val = period_realized_pnl[period]
+            cumulative_pnl += val
+            pnl_data.append({
+                'date': period,
+                'pnl': round(val, 2),
+                'cumulativePnL': round(cumulative_pnl, 2)
+            })
+
+    return {'data': pnl_data, 'totalPnL': round(cumulative_pnl, 2)}
+
+
+def aggregate_unrealized_profit(columns: Dict[str, np.ndarray]) -> Dict[str, Any]:
+    """Total cost, current value and ROI from 'initialValue' and 'currentValue' columns."""
+    total_cost = float(columns['initialValue'].sum())
+    total_current_value = float(columns['currentValue'].sum())
+
+    unrealized_profit = total_current_value - total_cost
+    roi = (unrealized_profit / total_cost * 100) if total_cost > 0 else 0.0
+
+    return {
+        'totalCost': round(total_cost, 2),
+        'currentValue': round(total_current_value, 2),
+        'unrealizedProfit': round(unrealized_profit, 2),
+        'roi': round(roi, 2),
+        'positionsCount': len(columns['currentValue'])
+    }
+
+
+def aggregate_sector_exposure(columns: Dict[str, np.ndarray], sector_names: List[str]) -> Dict[str, Any]:
+    """Sum 'currentValue' per sector code in 'sector', sorted by value."""
+    sector_values = np.bincount(columns['sector'], weights=columns['currentValue'], minlength=len(sector_names))
+    total_value = float(columns['currentValue'].sum())
+
+    results = []
+    for sector, value in sorted(zip(sector_names, sector_values.tolist()), key=lambda x: x[1], reverse=True):
+        percentage = (value / total_value * 100) if total_value > 0 else 0
+        results.append({
+            'sector': sector,
+            'value': round(value, 2),
+            'percentage': round(percentage, 2)
+        })
+
+    return {'sectors': results, 'totalValue': round(total_value, 2)}
+
+
+class AggregationDispatcher:
+    """
+    Runs an aggregation function inline for small inputs and in a process pool
+    for large ones, so whale wallets do not hold the GIL for everyone.
+    The function receives the raw rows and does its own parsing, so the
+    per-row work moves to the pool along with the arithmetic. Only use it for
+    work that outweighs the pickling round trip; plain sums are cheaper inline.
+    Call ``warm`` at startup so the first large wallet does not pay for spawning.
+    """
+
+    def __init__(self, inline_max_rows: int = INLINE_MAX_ROWS, workers: int = POOL_WORKERS):
+        self.inline_max_rows = inline_max_rows
+        self.workers = workers
+        self._pool: Optional[ProcessPoolExecutor] = None
+        self._lock = threading.Lock()
+
+    def run(self, func: Callable, rows: List[Any], *args: Any) -> Any:
+        if len(rows) < self.inline_max_rows or self.workers < 1:
+            return func(rows, *args)
+        try:
+            return self._get_pool().submit(func, rows, *args).result()
+        except (BrokenProcessPool, OSError, NotImplementedError):
+            # Platforms without working multiprocessing fall back to inline aggregation
+            self._reset_pool()
+            return func(rows, *args)
+
+    def warm(self):
+        """Start every worker process now rather than on the first large request."""
+        if self.workers < 1:
+            return
+        try:
+            pool = self._get_pool()
+            for future in [pool.submit(_noop) for _ in range(self.workers)]:
+                future.result()
+        except (BrokenProcessPool, OSError, NotImplementedError):
+            self._reset_pool()
+
+    def shutdown(self):
+        with self._lock:
+            if self._pool is not None:
+                self._pool.shutdown(wait=False, cancel_futures=True)
+                self._pool = None
+
+    def _get_pool(self) -> ProcessPoolExecutor:
+        with self._lock:
+            if self._pool is None:
+                # Spawn rather than fork: the server process is multi-threaded
+                self._pool = ProcessPoolExecutor(max_workers=self.workers,
+                                                 mp_context=multiprocessing.get_context('spawn'))
+            return self._pool
+
+    def _reset_pool(self):
+        with self._lock:
+            pool, self._pool = self._pool, None
+        if pool is not None:
+            pool.shutdown(wait=False, cancel_futures=True)
+
+
+def _noop():
+    return None
@@ -0,0 +1,221 @@
+import argparse
+import csv
+import io
+import itertools
+import os
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+from polymarket_api import PolymarketAPI
+
+
+# Page sizes stay within what each upstream endpoint returns per request,
+# since a short page is taken to mean the end of the data
+DATASETS = {
+    'activity': {
+        'endpoint': '/activity',
+        'page_size': 500,
+        'columns': [
+            ('timestamp', 'timestamp'), ('type', 'string'), ('side', 'string'),
+            ('conditionId', 'string'), ('asset', 'string'), ('slug', 'string'), ('title', 'string'),
+            ('outcome', 'string'), ('outcomeIndex', 'int'), ('size', 'float'), ('usdcSize', 'float'),
+            ('price', 'float'), ('transactionHash', 'string')
+        ]
+    },
+    'positions': {
+        'endpoint': '/positions',
+        'page_size': 500,
+        'columns': [
+            ('asset', 'string'), ('conditionId', 'string'), ('slug', 'string'), ('title', 'string'),
+            ('outcome', 'string'), ('outcomeIndex', 'int'), ('size', 'float'), ('avgPrice', 'float'),
+            ('curPrice', 'float'), ('initialValue', 'float'), ('currentValue', 'float'),
+            ('cashPnl', 'float'), ('percentPnl', 'float'), ('realizedPnl', 'float'),
+            ('redeemable', 'bool'), ('endDate', 'string')
+        ]
+    },
+    'closed-positions': {
+        'endpoint': '/closed-positions',
+        'page_size': 50,
+        'columns': [
+            ('asset', 'string'), ('conditionId', 'string'), ('slug', 'string'), ('title', 'string'),
+            ('outcome', 'string'), ('outcomeIndex', 'int'), ('avgPrice', 'float'), ('totalBought', 'float'),
+            ('realizedPnl', 'float'), ('curPrice', 'float'), ('timestamp', 'timestamp'), ('endDate', 'string')
+        ]
+    }
+}
+
+FORMATS = {
+    'csv': {'extension': 'csv', 'media_type': 'text/csv'},
+    'parquet': {'extension': 'parquet', 'media_type': 'application/vnd.apache.parquet'}
+}
+
+# Rows buffered per Parquet row group
+PARQUET_ROW_GROUP_SIZE = 10000
+
+
+class ExportError(Exception):
+    """Raised when the upstream API fails while an export is streaming."""
+
+    def __init__(self, result: Dict[str, Any]):
+        super().__init__(result.get('error', 'Unknown error'))
+        self.result = result
+
+
+def parquet_available() -> bool:
+    try:
+        import pyarrow  # noqa: F401
+        return True
+    except ImportError:
+        return False
+
+
+def _normalize(api: PolymarketAPI, value: Any, kind: str) -> Any:
+    if value is None or value == '':
+        return None
+    try:
+        if kind == 'float':
+            return float(value)
+        if kind == 'int':
+            return int(float(value))
+        if kind == 'timestamp':
+            return api._get_timestamp({'timestamp': value}) or None
+        if kind == 'bool':
+            return value.lower() == 'true' if isinstance(value, str) else bool(value)
+    except (TypeError, ValueError):
+        return None
+    return str(value)
+
+
+def iter_rows(api: PolymarketAPI, user: str, dataset: str) -> Iterator[List[Tuple]]:
+    """
+    Yield a wallet's dataset one upstream page at a time, as lists of typed row tuples
+    in column order. Raises ExportError if the upstream API fails mid-way.
+    """
+    spec = DATASETS[dataset]
+    columns = spec['columns']
+    for page in api.iter_pages(spec['endpoint'], {'user': user}, spec['page_size']):
+        if isinstance(page, dict):
+            raise ExportError(page)
+        yield [tuple(_normalize(api, item.get(name), kind) for name, kind in columns) for item in page]
+
+
+def stream_csv(chunks: Iterator[List[Tuple]], dataset: str) -> Iterator[bytes]:
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow([name for name, _ in DATASETS[dataset]['columns']])
+    for rows in chunks:
+        writer.writerows(rows)
+        yield buffer.getvalue().encode('utf-8')
+        buffer.seek(0)
+        buffer.truncate()
+
+
+class _DrainableSink(io.RawIOBase):
+    """Write-only file object whose contents can be taken as they are produced."""
+
+    def __init__(self):
+        self._chunks: List[bytes] = []
+
+    def writable(self) -> bool:
+        return True
+
+    def write(self, data) -> int:
+        self._chunks.append(bytes(data))
+        return len(data)
+
+    def drain(self) -> bytes:
+        data = b''.join(self._chunks)
+        self._chunks = []
+        return data
+
+
+def stream_parquet(chunks: Iterator[List[Tuple]], dataset: str,
+                   row_group_size: int = PARQUET_ROW_GROUP_SIZE) -> Iterator[bytes]:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    types = {'string': pa.string(), 'float': pa.float64(), 'int': pa.int64(),
+             'bool': pa.bool_(), 'timestamp': pa.timestamp('s', tz='UTC')}
+    columns = DATASETS[dataset]['columns']
+    schema = pa.schema([(name, types[kind]) for name, kind in columns])
+
+    sink = _DrainableSink()
+    writer = pq.ParquetWriter(sink, schema)
+    pending: List[Tuple] = []
+
+    def flush():
+        table = pa.Table.from_arrays([pa.array(column, type=field.type)
+                                      for column, field in zip(zip(*pending), schema)], schema=schema)
+        writer.write_table(table)
+        pending.clear()
+
+    # The first page is written as its own row group so bytes reach the client right away
+    first = True
+    for rows in chunks:
+        pending.extend(rows)
+        if first or len(pending) >= row_group_size:
+            first = False
+            if pending:
+                flush()
+            yield sink.drain()
+    if pending:
+        flush()
+    writer.close()
+    yield sink.drain()
+
+
+def open_export(api: PolymarketAPI, user: str, dataset: str, fmt: str) -> Any:
+    """
+    Start an export and return an iterator of file bytes, or an error dict.
+    The first upstream page is fetched eagerly so bad wallets or an unavailable
+    upstream are reported before any bytes are sent.
+    """
+    chunks = iter_rows(api, user, dataset)
+    try:
+        first = next(chunks, [])
+    except ExportError as e:
+        return e.result
+    chunks = itertools.chain([first], chunks)
+    if fmt == 'parquet':
+        return stream_parquet(chunks, dataset)
+    return stream_csv(chunks, dataset)
+
+
+def main(argv: Optional[List[str]] = None):
+    parser = argparse.ArgumentParser(description="Export a wallet's Polymarket history to CSV or Parquet")
+    parser.add_argument('--user', required=True, help='Wallet address')
+    parser.add_argument('--dataset', choices=['all', *DATASETS], default='all')
+    parser.add_argument('--format', choices=list(FORMATS), default='csv')
+    parser.add_argument('--output-dir', default='.')
+    args = parser.parse_args(argv)
+
+    if args.format == 'parquet' and not parquet_available():
+        parser.error('Parquet export requires pyarrow (pip install pyarrow)')
+
+    api = PolymarketAPI()
+    datasets = list(DATASETS) if args.dataset == 'all' else [args.dataset]
+    os.makedirs(args.output_dir, exist_ok=True)
+
+    for dataset in datasets:
+        path = os.path.join(args.output_dir, f"{args.user}-{dataset}.{FORMATS[args.format]['extension']}")
+        stream = open_export(api, args.user, dataset, args.format)
+        if isinstance(stream, dict):
+            raise SystemExit(f"Error exporting {dataset}: {stream['error']}")
+        # Write beside the target and rename at the end, so a failed export never leaves a truncated file
+        partial = f"{path}.part"
+        written = 0
+        try:
+            with open(partial, 'wb') as f:
+                for data in stream:
+                    f.write(data)
+                    written += len(data)
+            os.replace(partial, path)
+        except ExportError as e:
+            raise SystemExit(f"Error exporting {dataset}: {e}")
+        finally:
+            if os.path.exists(partial):
+                os.remove(partial)
+        print(f"Wrote {path} ({written} bytes)")
+
+
+if __name__ == "__main__":
+    main()
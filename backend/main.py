@@ -1,10 +1,30 @@
-from fastapi import FastAPI, HTTPException, Query
+from fastapi import Depends, FastAPI, HTTPException, Query, Request, Response
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import StreamingResponse
+from starlette.concurrency import iterate_in_threadpool
 from typing import Optional
 from polymarket_api import PolymarketAPI
+from scheduler import FairScheduler, SchedulerBusy
+from position_query import parse_list
+from revaluation import PositionRevaluator
+from position_sync import PositionStateStore
+from export import DATASETS, FORMATS, ExportError, open_export, parquet_available
+from contextlib import asynccontextmanager
+import asyncio
+import re
+import time
 import uvicorn
 
-app = FastAPI(title="PolyPortfolio API", description="FastAPI backend for Polymarket data API", version="1.0.0")
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Spawn the PnL history workers before the first large wallet needs them
+    await asyncio.to_thread(polymarket_api.aggregator.warm)
+    yield
+    polymarket_api.aggregator.shutdown()
+
+
+app = FastAPI(title="PolyPortfolio API", description="FastAPI backend for Polymarket data API", version="1.0.0", lifespan=lifespan)
 
 # CORS configuration - Allow all origins for now (can be restricted later)
 import os
@@ -22,11 +42,49 @@ app.add_middleware(
     allow_origins=allowed_origins, 
     allow_credentials=True, 
     allow_methods=["*"], 
-    allow_headers=["*"]
+    allow_headers=["*"],
+    expose_headers=["Retry-After", "X-Queue-Wait-Ms", "Server-Timing"]
 )
 
 polymarket_api = PolymarketAPI()
 
+# Keeps each wallet's last positions so refreshes only need fresh prices
+revaluator = PositionRevaluator(
+    polymarket_api,
+    max_age=float(os.getenv("REVALUATION_MAX_AGE", "600")),
+    max_wallets=int(os.getenv("REVALUATION_MAX_WALLETS", "256")),
+    max_positions=int(os.getenv("REVALUATION_MAX_POSITIONS", "200000"))
+)
+
+# Versioned position state for delta sync, fed by the revaluator
+position_states = PositionStateStore(
+    polymarket_api,
+    revaluator.get_positions,
+    max_wallets=int(os.getenv("DELTA_SYNC_MAX_WALLETS", "256")),
+    max_positions=int(os.getenv("DELTA_SYNC_MAX_POSITIONS", "200000"))
+)
+
+# Fair-queue admission control for upstream work, tunable per deployment
+scheduler = FairScheduler(
+    max_active=int(os.getenv("SCHEDULER_MAX_ACTIVE", "8")),
+    max_active_per_wallet=int(os.getenv("SCHEDULER_MAX_ACTIVE_PER_WALLET", "2")),
+    max_queue=int(os.getenv("SCHEDULER_MAX_QUEUE", "64")),
+    max_wallet_queue=int(os.getenv("SCHEDULER_MAX_WALLET_QUEUE", "16")),
+    upstream_per_request=int(os.getenv("SCHEDULER_UPSTREAM_PER_REQUEST", "4"))
+)
+
+# Exports hold their slot while the client downloads, so they get a separate, smaller pool.
+# Reserving every slot makes the per-wallet cap strict, even on an idle server.
+export_max_active = int(os.getenv("EXPORT_MAX_ACTIVE", "2"))
+export_scheduler = FairScheduler(
+    max_active=export_max_active,
+    max_active_per_wallet=int(os.getenv("EXPORT_MAX_ACTIVE_PER_WALLET", "1")),
+    max_queue=int(os.getenv("EXPORT_MAX_QUEUE", "16")),
+    max_wallet_queue=int(os.getenv("EXPORT_MAX_WALLET_QUEUE", "2")),
+    upstream_per_request=int(os.getenv("SCHEDULER_UPSTREAM_PER_REQUEST", "4")),
+    reserved_slots=export_max_active
+)
+
 
 def handle_api_result(result: dict):
     if 'error' in result:
@@ -35,54 +93,186 @@ def handle_api_result(result: dict):
     return result
 
 
+def client_key(request: Request) -> str:
+    # Wallet-less routes are queued per client instead of per wallet
+    return f"client:{request.client.host if request.client else 'unknown'}"
+
+
+async def run_scheduled(key: str, response: Response, func, *args):
+    try:
+        result, wait = await scheduler.run(key, func, *args)
+    except SchedulerBusy as e:
+        raise HTTPException(status_code=429, detail=e.reason, headers={"Retry-After": str(e.retry_after)})
+    wait_ms = wait * 1000
+    response.headers["X-Queue-Wait-Ms"] = f"{wait_ms:.1f}"
+    response.headers["Server-Timing"] = f"queue;dur={wait_ms:.1f}"
+    return handle_api_result(result)
+
+
 @app.get("/api/activity", tags=["Activity"])
-async def get_activity(user: str = Query(..., description="Wallet address"), limit: int = Query(500, ge=1, le=1000), offset: int = Query(0, ge=0)):
-    return handle_api_result(polymarket_api.get_activity(user, limit, offset))
+async def get_activity(response: Response, user: str = Query(..., description="Wallet address"), limit: int = Query(500, ge=1, le=1000), offset: int = Query(0, ge=0)):
+    return await run_scheduled(user, response, polymarket_api.get_activity, user, limit, offset)
 
 
 @app.get("/api/markets", tags=["Markets"])
-async def get_markets(limit: int = Query(100, ge=1, le=1000), offset: int = Query(0, ge=0), active: Optional[bool] = Query(None)):
-    return handle_api_result(polymarket_api.get_markets(limit, offset, active))
+async def get_markets(request: Request, response: Response, limit: int = Query(100, ge=1, le=1000), offset: int = Query(0, ge=0), active: Optional[bool] = Query(None)):
+    return await run_scheduled(client_key(request), response, polymarket_api.get_markets, limit, offset, active)
 
 
 @app.get("/api/markets/{market_id}", tags=["Markets"])
-async def get_market(market_id: str):
-    return handle_api_result(polymarket_api.get_market(market_id))
+async def get_market(market_id: str, request: Request, response: Response):
+    return await run_scheduled(client_key(request), response, polymarket_api.get_market, market_id)
+
+
+class PositionQueryParams:
+    def __init__(
+        self,
+        fields: Optional[str] = Query(None, description="Comma-separated fields to return"),
+        min_value: Optional[float] = Query(None, description="Minimum position value"),
+        sector: Optional[str] = Query(None, description="Comma-separated sectors"),
+        market: Optional[str] = Query(None, description="Comma-separated condition ids or slugs"),
+        sort: Optional[str] = Query(None, description="Field to sort by"),
+        order: str = Query("desc", pattern="^(asc|desc)$"),
+        page: int = Query(1, ge=1),
+        limit: Optional[int] = Query(None, ge=1, le=1000)
+    ):
+        if page != 1 and limit is None:
+            raise HTTPException(status_code=422, detail="page requires limit")
+        self.fields = parse_list(fields)
+        self.min_value = min_value
+        self.sectors = parse_list(sector)
+        self.markets = parse_list(market)
+        self.sort = sort
+        self.order = order
+        self.page = page
+        self.limit = limit
+
+    def is_empty(self) -> bool:
+        return not (self.fields or self.min_value is not None or self.sectors or self.markets or self.sort or self.limit)
+
+
+async def run_position_query(user: str, response: Response, query: PositionQueryParams, closed: bool):
+    return await run_scheduled(
+        user, response, polymarket_api.query_positions, user, closed, query.fields, query.min_value,
+        query.sectors, query.markets, query.sort, query.order, query.page, query.limit
+    )
 
 
 @app.get("/api/positions", tags=["Positions"])
-async def get_positions(user: str = Query(..., description="Wallet address")):
-    return handle_api_result(polymarket_api.get_user_positions(user))
+async def get_positions(response: Response, user: str = Query(..., description="Wallet address"), query: PositionQueryParams = Depends()):
+    if query.is_empty():
+        return await run_scheduled(user, response, polymarket_api.get_user_positions, user)
+    return await run_position_query(user, response, query, closed=False)
+
+
+@app.get("/api/positions/delta", tags=["Positions"])
+async def get_position_changes(response: Response, user: str = Query(..., description="Wallet address"), since: Optional[str] = Query(None, description="Last version received")):
+    return await run_scheduled(user, response, position_states.changes_since, user, since)
 
 
 @app.get("/api/pnl", tags=["PNL"])
-async def get_pnl(user: str = Query(..., description="Wallet address"), granularity: str = Query("daily")):
-    return handle_api_result(polymarket_api.calculate_pnl_history(user, granularity))
+async def get_pnl(response: Response, user: str = Query(..., description="Wallet address"), granularity: str = Query("daily")):
+    return await run_scheduled(user, response, polymarket_api.calculate_pnl_history, user, granularity)
 
 
 @app.get("/api/total-pnl", tags=["PNL"])
-async def get_total_pnl(user: str = Query(..., description="Wallet address")):
-    return handle_api_result(polymarket_api.calculate_total_pnl(user))
+async def get_total_pnl(response: Response, user: str = Query(..., description="Wallet address")):
+    return await run_scheduled(user, response, polymarket_api.calculate_total_pnl, user)
 
 
 @app.get("/api/unrealized-profit", tags=["PNL"])
-async def get_unrealized_profit(user: str = Query(..., description="Wallet address")):
-    return handle_api_result(polymarket_api.calculate_unrealized_profit(user))
+async def get_unrealized_profit(response: Response, user: str = Query(..., description="Wallet address")):
+    return await run_scheduled(user, response, polymarket_api.calculate_unrealized_profit, user)
 
 
 @app.get("/api/value", tags=["Value"])
-async def get_value(user: str = Query(..., description="Wallet address")):
-    return handle_api_result(polymarket_api.get_user_value(user))
+async def get_value(response: Response, user: str = Query(..., description="Wallet address")):
+    return await run_scheduled(user, response, polymarket_api.get_user_value, user)
+
+
+@app.get("/api/revalue", tags=["Value"])
+async def get_revalued_portfolio(response: Response, user: str = Query(..., description="Wallet address"), include_positions: bool = Query(False)):
+    return await run_scheduled(user, response, revaluator.revalue, user, include_positions)
 
 
 @app.get("/api/sector-exposure", tags=["Exposure"])
-async def get_sector_exposure(user: str = Query(..., description="Wallet address")):
-    return handle_api_result(polymarket_api.calculate_sector_exposure(user))
+async def get_sector_exposure(response: Response, user: str = Query(..., description="Wallet address")):
+    return await run_scheduled(user, response, polymarket_api.calculate_sector_exposure, user)
+
+
+@app.get("/api/scenarios", tags=["Exposure"])
+async def get_scenarios(response: Response, user: str = Query(..., description="Wallet address"), scenarios: int = Query(100000, ge=1000, le=1000000), seed: Optional[int] = Query(None)):
+    return await run_scheduled(user, response, polymarket_api.calculate_scenario_pnl, user, scenarios, seed)
 
 
 @app.get("/api/closed-positions", tags=["Positions"])
-async def get_closed_positions(user: str = Query(..., description="Wallet address")):
-    return handle_api_result(polymarket_api.get_closed_positions(user))
+async def get_closed_positions(response: Response, user: str = Query(..., description="Wallet address"), query: PositionQueryParams = Depends()):
+    if query.is_empty():
+        return await run_scheduled(user, response, polymarket_api.get_closed_positions, user)
+    return await run_position_query(user, response, query, closed=True)
+
+
+@app.get("/api/export", tags=["Export"])
+async def export_history(
+    user: str = Query(..., description="Wallet address"),
+    dataset: str = Query("activity", pattern=f"^({'|'.join(DATASETS)})$"),
+    format: str = Query("csv", pattern=f"^({'|'.join(FORMATS)})$")
+):
+    if format == "parquet" and not parquet_available():
+        raise HTTPException(status_code=501, detail="Parquet export requires pyarrow on the server")
+
+    # The export holds an export slot for the whole life of the stream
+    try:
+        wait = await export_scheduler.acquire(user)
+    except SchedulerBusy as e:
+        raise HTTPException(status_code=429, detail=e.reason, headers={"Retry-After": str(e.retry_after)})
+    started_at = time.monotonic()
+    context = export_scheduler.request_context()
+
+    try:
+        # The first page is fetched here so upstream errors surface as a proper status code
+        stream = await asyncio.to_thread(context.run, open_export, polymarket_api, user, dataset, format)
+        if isinstance(stream, dict):
+            handle_api_result(stream)
+    except BaseException:
+        export_scheduler.release(user, time.monotonic() - started_at)
+        raise
+
+    def pages():
+        # Each chunk is produced inside the request's context so its upstream budget applies
+        while True:
+            chunk = context.run(next, stream, None)
+            if chunk is None:
+                return
+            yield chunk
+
+    async def body():
+        try:
+            async for chunk in iterate_in_threadpool(pages()):
+                yield chunk
+        finally:
+            export_scheduler.release(user, time.monotonic() - started_at)
+
+    # Start the body now: once started, even a response that is never sent still
+    # releases the slot when the generator is closed or garbage-collected
+    chunks = body()
+    try:
+        first = await anext(chunks, b"")
+    except ExportError as e:
+        handle_api_result(e.result)
+
+    async def content():
+        yield first
+        async for chunk in chunks:
+            yield chunk
+
+    filename = f"{re.sub(r'[^0-9A-Za-z_-]', '_', user)}-{dataset}.{FORMATS[format]['extension']}"
+    wait_ms = wait * 1000
+    return StreamingResponse(content(), media_type=FORMATS[format]["media_type"], headers={
+        "Content-Disposition": f'attachment; filename="{filename}"',
+        "X-Queue-Wait-Ms": f"{wait_ms:.1f}",
+        "Server-Timing": f"queue;dur={wait_ms:.1f}"
+    })
 
 
 @app.get("/health", tags=["Health"])
@@ -90,6 +280,11 @@ async def health_check():
     return {"status": "healthy", "service": "PolyPortfolio API"}
 
 
+@app.get("/health/scheduler", tags=["Health"])
+async def scheduler_stats():
+    return {**scheduler.stats(), 'export': export_scheduler.stats()}
+
+
 @app.get("/", tags=["Root"])
 async def root():
     return {
@@ -1,13 +1,26 @@
 import requests
+import contextvars
 import json
 import os
+from concurrent.futures import ThreadPoolExecutor
 from typing import Optional, Dict, Any
-from datetime import datetime, timedelta
-from collections import defaultdict
+from datetime import datetime
+import numpy as np
+from scenario_engine import simulate_resolution_pnl
+from scheduler import upstream_slot, UPSTREAM_CONCURRENCY
+from aggregation import (AggregationDispatcher, aggregate_pnl_history, aggregate_sector_exposure,
+                         aggregate_unrealized_profit, closed_position_pnl, date_key, row_avg_price,
+                         row_current_price, row_size, row_timestamp, to_float)
+from position_query import query_positions
 
 
 class PolymarketAPI:    
     BASE_URL = "https://data-api.polymarket.com"
+    GAMMA_URL = "https://gamma-api.polymarket.com"
+    
+    # Condition ids per Gamma /markets lookup, and lookups in flight per call
+    PRICE_BATCH_SIZE = 50
+    PRICE_BATCH_WORKERS = 4
     
     # Valid sector tags from Polymarket
     VALID_SECTORS = {
@@ -22,10 +35,16 @@ class PolymarketAPI:
             'Accept': 'application/json',
             'User-Agent': 'PolyPortfolio/1.0'
         })
+        # Keep one pooled connection per upstream slot so concurrent calls reuse sockets
+        adapter = requests.adapters.HTTPAdapter(pool_maxsize=UPSTREAM_CONCURRENCY)
+        self.session.mount('https://', adapter)
+        # Only PnL history bucketing is heavy enough to be worth a process pool
+        self.aggregator = AggregationDispatcher()
     
     def _request(self, method: str, endpoint: str, params: Optional[Dict] = None) -> Dict[str, Any]:
         try:
-            response = self.session.request(method, f"{self.BASE_URL}{endpoint}", params=params)
+            with upstream_slot():
+                response = self.session.request(method, f"{self.BASE_URL}{endpoint}", params=params)
             response.raise_for_status()
             return response.json()
         except requests.exceptions.RequestException as e:
@@ -53,6 +72,50 @@ class PolymarketAPI:
     def get_market(self, market_id: str) -> Dict[str, Any]:
         return self._request('GET', f'/markets/{market_id}')
     
+    def get_market_prices(self, condition_ids: list) -> Dict[str, list]:
+        """
+        Get current outcome prices for many markets with batched Gamma API lookups.
+        Batches run concurrently, each under the calling request's upstream slots.
+        
+        Returns:
+            dict: condition id -> list of outcome prices, indexed like outcomeIndex.
+            Markets that could not be fetched are left out.
+        """
+        unique_ids = list(dict.fromkeys(cid for cid in condition_ids if cid))
+        batches = [unique_ids[i:i + self.PRICE_BATCH_SIZE] for i in range(0, len(unique_ids), self.PRICE_BATCH_SIZE)]
+        if not batches:
+            return {}
+        
+        with ThreadPoolExecutor(max_workers=min(self.PRICE_BATCH_WORKERS, len(batches))) as executor:
+            # Each batch gets its own context copy so the request's upstream budget follows it
+            futures = [executor.submit(contextvars.copy_context().run, self._fetch_price_batch, batch) for batch in batches]
+            prices = {}
+            for future in futures:
+                prices.update(future.result())
+        return prices
+    
+    def _fetch_price_batch(self, condition_ids: list) -> Dict[str, list]:
+        params = [('condition_ids', cid) for cid in condition_ids] + [('limit', len(condition_ids))]
+        try:
+            with upstream_slot():
+                response = self.session.get(f"{self.GAMMA_URL}/markets", params=params, timeout=10)
+            response.raise_for_status()
+            markets = response.json()
+        except (requests.exceptions.RequestException, ValueError):
+            return {}
+        
+        prices = {}
+        for market in markets if isinstance(markets, list) else []:
+            outcome_prices = market.get('outcomePrices')
+            if isinstance(outcome_prices, str):
+                try:
+                    outcome_prices = json.loads(outcome_prices)
+                except ValueError:
+                    continue
+            if market.get('conditionId') and isinstance(outcome_prices, list):
+                prices[market['conditionId']] = [self._to_float(p) for p in outcome_prices]
+        return prices
+    
     def get_user_positions(self, user: str, limit: int = 500) -> Dict[str, Any]:
         """
         Get all positions for a user using pagination.
@@ -65,47 +128,79 @@ class PolymarketAPI:
         Returns:
             dict: Contains 'data' (list of all positions) and 'count' (total count)
         """
+        # Using default sizeThreshold (1.0) to filter out small positions
         all_positions = []
-        offset = 0
-        has_more = True
-        
-        while has_more:
-            params = {
-                'user': user,
-                'limit': limit,
-                'offset': offset
-                # Using default sizeThreshold (1.0) to filter out small positions
-            }
-            
-            result = self._request('GET', '/positions', params)
-            
-            if 'error' in result:
-                return result
-            
-            positions_data = self._extract_list(result)
-            
-            if not positions_data:  # No more data
-                has_more = False
-            else:
-                all_positions.extend(positions_data)
-                
-                # If we got fewer results than the limit, we've reached the end
-                if len(positions_data) < limit:
-                    has_more = False
-                else:
-                    offset += limit
+        for page in self.iter_pages('/positions', {'user': user}, limit):
+            if isinstance(page, dict):
+                return page
+            all_positions.extend(page)
         
         return {
             'data': all_positions,
             'count': len(all_positions)
         }
     
+    def iter_pages(self, endpoint: str, params: Dict[str, Any], limit: int = 500, offset: int = 0):
+        """
+        Yield each page of an offset-paginated endpoint as a list, one request at a time.
+        Stops after an empty or short page. On error, yields the error dict and stops.
+        """
+        while True:
+            result = self._request('GET', endpoint, {**params, 'limit': limit, 'offset': offset})
+            
+            if 'error' in result:
+                yield result
+                return
+            
+            page = self._extract_list(result)
+            if not page:  # No more data
+                return
+            yield page
+            
+            # If we got fewer results than the limit, we've reached the end
+            if len(page) < limit:
+                return
+            offset += limit
+    
     def get_user_value(self, user: str) -> Dict[str, Any]:
         return self._request('GET', '/value', {'user': user})
     
     def get_closed_positions(self, user: str) -> Dict[str, Any]:
         return self._request('GET', '/closed-positions', {'user': user, 'limit': 5000})
     
+    def query_positions(self, user: str, closed: bool = False, fields: Optional[list] = None,
+                        min_value: Optional[float] = None, sectors: Optional[list] = None,
+                        markets: Optional[list] = None, sort: Optional[str] = None, order: str = 'desc',
+                        page: int = 1, limit: Optional[int] = None) -> Dict[str, Any]:
+        """
+        Filtered, sorted, paginated and projected view of a user's open or closed positions.
+        min_value compares against currentValue for open positions and the amount
+        invested (totalBought * avgPrice) for closed ones.
+        Sectors are only looked up when filtering, sorting or projecting on 'sector'.
+        """
+        if closed:
+            result = self.get_closed_positions(user)
+            value_of = lambda p: self._to_float(p.get('totalBought', 0)) * self._get_avg_price(p)
+        else:
+            result = self.get_user_positions(user)
+            value_of = lambda p: self._to_float(p.get('currentValue', 0))
+        if 'error' in result:
+            return result
+        
+        positions = self._extract_list(result)
+        
+        if sectors or sort == 'sector' or (fields and 'sector' in fields):
+            label_cache = self._load_cache()
+            position_sectors, _ = self._get_position_sectors(positions, label_cache)
+            self._save_cache(label_cache)
+            positions = [{**p, 'sector': sector} for p, sector in zip(positions, position_sectors)]
+        
+        return {
+            'user': user,
+            **query_positions(positions, value_of, fields=fields, min_value=min_value, sectors=sectors,
+                              markets=markets, sort=sort, order=order, page=page, limit=limit)
+        }
+    
     def calculate_total_pnl(self, user: str) -> Dict[str, Any]:
         """
         Calculate total PnL: Realized PnL (from closed positions) + Current Portfolio Value
@@ -155,27 +250,12 @@ class PolymarketAPI:
         
         positions = positions_result.get('data', []) if isinstance(positions_result, dict) else self._extract_list(positions_result)
         
-        total_cost = 0.0
-        total_current_value = 0.0
-        
-        for position in positions:
-            cost = self._to_float(position.get('initialValue', 0))
-            current_value = self._to_float(position.get('currentValue', 0))
-            
-            total_cost += cost
-            total_current_value += current_value
-        
-        unrealized_profit = total_current_value - total_cost
-        roi = (unrealized_profit / total_cost * 100) if total_cost > 0 else 0.0
-        
-        return {
-            'user': user,
-            'totalCost': round(total_cost, 2),
-            'currentValue': round(total_current_value, 2),
-            'unrealizedProfit': round(unrealized_profit, 2),
-            'roi': round(roi, 2),
-            'positionsCount': len(positions)
+        columns = {
+            'initialValue': self._float_column(positions, 'initialValue'),
+            'currentValue': self._float_column(positions, 'currentValue')
         }
+        
+        return {'user': user, **aggregate_unrealized_profit(columns)}
     
     def get_condition(self, condition_id: str) -> Dict[str, Any]:
         result = self._request('GET', f'/conditions/{condition_id}')
@@ -192,74 +272,23 @@ class PolymarketAPI:
             return positions_result
         positions_list = positions_result.get('data', []) if isinstance(positions_result, dict) else self._extract_list(positions_result)
 
-        period_realized_pnl = defaultdict(float)
+        # Open positions only feed one sum, which is cheaper here than shipping the rows to a worker
+        size = np.array([self._get_size(p) for p in positions_list], dtype=np.float64)
+        avg_price = np.array([self._get_avg_price(p) for p in positions_list], dtype=np.float64)
+        cur_price = np.array([self._get_current_price(p) for p in positions_list], dtype=np.float64)
+        unrealized_pnl = float(np.sum((cur_price - avg_price) * size))
 
-        for closed_pos in closed_positions_list:
-            # Prefer source PnL if present (assumed dollars)
-            pnl_value = (closed_pos.get('pnl') or closed_pos.get('realizedPnl') or
-                        closed_pos.get('cashPnl') or closed_pos.get('profit') or
-                        closed_pos.get('realized_pnl') or closed_pos.get('cash_pnl'))
+        # Closed rows are parsed and bucketed in the pool for large wallets
+        result = self.aggregator.run(aggregate_pnl_history, closed_positions_list, unrealized_pnl,
+                                     granularity, datetime.now().timestamp())
+        return {'user': user, **result}
 
-            if pnl_value is None:
-                # Recompute in dollars if needed (prices 0–1 or dollar prices both fine)
-                size = self._get_size(closed_pos)
-                avg_price = self._get_avg_price(closed_pos)
-                sell_price = (self._get_current_price(closed_pos) or
-                            closed_pos.get('sellPrice') or
-                            closed_pos.get('closePrice') or 0)
-                if size is not None and avg_price is not None and sell_price is not None:
-                    pnl_value = (float(sell_price) - float(avg_price)) * float(size)
-                else:
-                    pnl_value = 0.0
-
-            pnl_value = self._to_float(pnl_value)
-
-            ts = self._get_timestamp(closed_pos)
-            if ts and ts > 0:
-                date_key = self._get_date_key(ts, granularity)
-            else:
-                # No timestamp: use today's period, not epoch
-                date_key = self._get_date_key(datetime.now().timestamp(), granularity)
-
-            period_realized_pnl[date_key] += pnl_value
-
-        # Unrealized PnL as of "today"
-        unrealized_pnl = 0.0
-        for p in positions_list:
-            size = self._get_size(p)
-            avg_price = self._get_avg_price(p)
-            cur_price = self._get_current_price(p)
-            if size is None or avg_price is None or cur_price is None:
-                continue
-            unrealized_pnl += (float(cur_price) - float(avg_price)) * float(size)
+    def _closed_position_pnl(self, closed_pos: Dict[str, Any]) -> float:
+        return closed_position_pnl(closed_pos)
 
-        if unrealized_pnl != 0.0:
-            today_key = self._get_date_key(datetime.now().timestamp(), granularity)
-            period_realized_pnl[today_key] += unrealized_pnl
+    def _float_column(self, items: list, key: str) -> np.ndarray:
+        return np.array([self._to_float(item.get(key, 0)) for item in items], dtype=np.float64)
 
-        # Build sorted series; ensure _get_date_key returns sortable ISO-like keys
-        all_periods = sorted(period_realized_pnl.keys())
-        cumulative_pnl = 0.0
-        pnl_data = []
-
-        if not all_periods and granularity == 'daily':
-            today = datetime.now()
-            pnl_data = [{
-                'date': (today - timedelta(days=i)).strftime('%Y-%m-%d'),
-                'pnl': 0.0,
-                'cumulativePnL': 0.0
-            } for i in range(29, -1, -1)]
-        else:
-            for period in all_periods:
-                val = period_realized_pnl[period]
-                cumulative_pnl += val
-                pnl_data.append({
-                    'date': period,
-                    'pnl': round(val, 2),
-                    'cumulativePnL': round(cumulative_pnl, 2)
-                })
-
-        return {'user': user, 'data': pnl_data, 'totalPnL': round(cumulative_pnl, 2)}
 
     
     def _get_condition_id(self, item: Dict[str, Any]) -> Optional[str]:
@@ -274,46 +303,22 @@ class PolymarketAPI:
         return None
     
     def _get_size(self, item: Dict[str, Any]) -> float:
-        size = item.get('size') or item.get('shares') or item.get('quantity') or item.get('amount') or 0
-        if 'sharesNum' in item:
-            try:
-                return float(item['sharesNum'])
-            except (ValueError, TypeError):
-                pass
-        return self._to_float(size)
+        return row_size(item)
     
     def _get_avg_price(self, position: Dict[str, Any]) -> float:
-        return self._to_float(position.get('avgPrice') or position.get('averagePrice') or position.get('costBasis') or 0)
+        return row_avg_price(position)
     
     def _get_current_price(self, position: Dict[str, Any]) -> float:
-        return self._to_float(position.get('curPrice') or position.get('currentPrice') or position.get('price') or 0)
+        return row_current_price(position)
     
     def _get_timestamp(self, item: Dict[str, Any]) -> int:
-        timestamp = item.get('timestamp') or item.get('createdAt') or item.get('created') or 0
-        
-        if isinstance(timestamp, str):
-            try:
-                return int(timestamp) if timestamp.isdigit() else int(datetime.fromisoformat(timestamp.replace('Z', '+00:00')).timestamp())
-            except (ValueError, AttributeError):
-                return 0
-        
-        if isinstance(timestamp, (int, float)):
-            return int(timestamp / 1000) if timestamp > 1e10 else int(timestamp)
-        
-        return 0
+        return row_timestamp(item)
     
     def _get_date_key(self, timestamp: int, granularity: str = 'daily') -> str:
-        dt = datetime.fromtimestamp(timestamp) if timestamp > 0 else datetime.now()
-        fmt = '%Y-%m-%d' if granularity == 'daily' else '%Y-%m'
-        return dt.strftime(fmt)
+        return date_key(timestamp, granularity)
     
     def _to_float(self, value: Any) -> float:
-        if isinstance(value, str):
-            try:
-                return float(value)
-            except ValueError:
-                return 0.0
-        return float(value) if value else 0.0
+        return to_float(value)
     
     def _normalize_sector(self, tag_label: str) -> str:
         """
@@ -406,7 +411,8 @@ class PolymarketAPI:
         try:
             # Get market details using slug
             market_url = f'https://gamma-api.polymarket.com/markets/slug/{slug}'
-            market_response = requests.get(market_url, timeout=5)
+            with upstream_slot():
+                market_response = self.session.get(market_url, timeout=5)
             
             if market_response.status_code == 200:
                 market_data = market_response.json()
@@ -424,7 +430,8 @@ class PolymarketAPI:
                 market_id = market_data.get('id')
                 if market_id:
                     tags_url = f'https://gamma-api.polymarket.com/markets/{market_id}/tags'
-                    tags_response = requests.get(tags_url, timeout=5)
+                    with upstream_slot():
+                        tags_response = self.session.get(tags_url, timeout=5)
                     
                     if tags_response.status_code == 200:
                         tags_data = tags_response.json()
@@ -441,6 +448,23 @@ class PolymarketAPI:
         cache[slug] = 'Other'
         return 'Other'
     
+    def _get_position_sectors(self, positions: list, label_cache: Dict[str, str]) -> tuple:
+        """
+        Assign a sector to every position, in order.
+        Returns the list of sectors and the number of Gamma API lookups made.
+        """
+        sectors = []
+        api_calls_made = 0
+        for position in positions:
+            # Get slug and fetch sector label (checks cache first)
+            slug = position.get('slug', '')
+            
+            was_cached = slug in label_cache
+            sectors.append(self._get_market_label(slug, label_cache))
+            if not was_cached and slug:
+                api_calls_made += 1
+        return sectors, api_calls_made
+    
     def calculate_sector_exposure(self, user: str) -> Dict[str, Any]:
         """
         Calculate portfolio exposure by sector using Gamma API tags.
@@ -456,45 +480,56 @@ class PolymarketAPI:
         # Load cache from file
         label_cache = self._load_cache()
         
-        sector_values = defaultdict(float)
-        total_value = 0.0
-        api_calls_made = 0
-        
-        # Process positions and categorize by sector
-        for position in positions:
-            # Get position value - use currentValue from the API response
-            value = self._to_float(position.get('currentValue', 0))
-            total_value += value
-            
-            # Get slug and fetch sector label (checks cache first)
-            slug = position.get('slug', '')
-            
-            was_cached = slug in label_cache
-            sector = self._get_market_label(slug, label_cache)
-            if not was_cached and slug:
-                api_calls_made += 1
-            
-            sector_values[sector] += value
+        position_sectors, api_calls_made = self._get_position_sectors(positions, label_cache)
         
         # Save updated cache
         self._save_cache(label_cache)
         
-        # Build results
-        sorted_sectors = sorted(sector_values.items(), key=lambda x: x[1], reverse=True)
-        
-        results = []
-        for sector, value in sorted_sectors:
-            percentage = (value / total_value * 100) if total_value > 0 else 0
-            results.append({
-                'sector': sector,
-                'value': round(value, 2),
-                'percentage': round(percentage, 2)
-            })
+        # Encode sectors as integer codes so the aggregation input stays compact
+        sector_names = sorted(set(position_sectors))
+        sector_codes = {sector: i for i, sector in enumerate(sector_names)}
+        columns = {
+            'currentValue': self._float_column(positions, 'currentValue'),
+            'sector': np.array([sector_codes[s] for s in position_sectors], dtype=np.int64)
+        }
+        result = aggregate_sector_exposure(columns, sector_names)
         
         return {
             'user': user,
-            'sectors': results,
-            'totalValue': round(total_value, 2),
+            **result,
             'apiCallsMade': api_calls_made,
             'cachedLabels': len(label_cache)
         }
+    
+    def calculate_scenario_pnl(self, user: str, scenarios: int = 100000, seed: Optional[int] = None) -> Dict[str, Any]:
+        """
+        Simulate the portfolio's PnL under independent resolution of every open market.
+        Uses curPrice as the probability of each held outcome winning, and breaks the
+        results down by the same sectors as calculate_sector_exposure.
+        """
+        positions_result = self.get_user_positions(user)
+        if 'error' in positions_result:
+            return positions_result
+        
+        positions = positions_result.get('data', [])
+        
+        label_cache = self._load_cache()
+        sectors, api_calls_made = self._get_position_sectors(positions, label_cache)
+        self._save_cache(label_cache)
+        
+        # Positions without a condition id are treated as their own market
+        market_ids = [self._get_condition_id(p) or f"position-{i}" for i, p in enumerate(positions)]
+        outcome_index = np.array([int(self._to_float(p.get('outcomeIndex', 0))) for p in positions], dtype=np.int64)
+        size = np.array([self._get_size(p) for p in positions], dtype=np.float64)
+        price = np.array([self._get_current_price(p) for p in positions], dtype=np.float64)
+        cost = np.array([self._to_float(p.get('initialValue', 0)) for p in positions], dtype=np.float64)
+        value = np.array([self._to_float(p.get('currentValue', 0)) for p in positions], dtype=np.float64)
+        
+        result = simulate_resolution_pnl(market_ids, outcome_index, size, price, cost, value, sectors,
+                                         scenarios=scenarios, seed=seed)
+        result.update({
+            'user': user,
+            'positionsCount': len(positions),
+            'apiCallsMade': api_calls_made
+        })
+        return result
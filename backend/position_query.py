@@ -0,0 +1,73 @@
+from typing import Any, Callable, Dict, List, Optional
+
+
+def parse_list(value: Optional[str]) -> Optional[List[str]]:
+    """Split a comma-separated query parameter, ignoring blanks."""
+    if value is None:
+        return None
+    items = [item.strip() for item in value.split(',') if item.strip()]
+    return items or None
+
+
+def _sort_key(value: Any):
+    # Numbers (and numeric strings) sort numerically, everything else as text
+    if isinstance(value, bool):
+        return (0, float(value))
+    if isinstance(value, (int, float)):
+        return (0, float(value))
+    if isinstance(value, str):
+        try:
+            return (0, float(value))
+        except ValueError:
+            return (1, value.lower())
+    return (1, str(value))
+
+
+def _matches_market(position: Dict[str, Any], markets: set) -> bool:
+    return any(str(position.get(key, '')).lower() in markets
+               for key in ('conditionId', 'slug', 'eventSlug', 'asset'))
+
+
+def query_positions(positions: List[Dict[str, Any]], value_of: Callable[[Dict[str, Any]], float],
+                    fields: Optional[List[str]] = None, min_value: Optional[float] = None,
+                    sectors: Optional[List[str]] = None, markets: Optional[List[str]] = None,
+                    sort: Optional[str] = None, order: str = 'desc',
+                    page: int = 1, limit: Optional[int] = None) -> Dict[str, Any]:
+    """
+    Filter, sort, paginate and project a list of positions.
+
+    ``value_of`` returns the value compared against ``min_value``. Sector filters
+    expect each position to carry a 'sector' key. Positions missing the sort key
+    always come last. ``total`` is the number of matches before pagination.
+    """
+    rows = positions
+    if min_value is not None:
+        rows = [p for p in rows if value_of(p) >= min_value]
+    if sectors:
+        wanted = {s.lower() for s in sectors}
+        rows = [p for p in rows if str(p.get('sector', '')).lower() in wanted]
+    if markets:
+        wanted = {m.lower() for m in markets}
+        rows = [p for p in rows if _matches_market(p, wanted)]
+
+    if sort:
+        present = [p for p in rows if p.get(sort) is not None]
+        missing = [p for p in rows if p.get(sort) is None]
+        present.sort(key=lambda p: _sort_key(p[sort]), reverse=(order == 'desc'))
+        rows = present + missing
+
+    total = len(rows)
+    if limit is not None:
+        start = (page - 1) * limit
+        rows = rows[start:start + limit]
+
+    if fields:
+        rows = [{key: p[key] for key in fields if key in p} for p in rows]
+
+    return {
+        'data': rows,
+        'count': len(rows),
+        'total': total,
+        'page': page if limit is not None else 1,
+        'limit': limit
+    }
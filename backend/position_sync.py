@@ -0,0 +1,131 @@
+import secrets
+import threading
+from collections import OrderedDict, deque
+from typing import Any, Callable, Dict, Optional
+
+from aggregation import aggregate_unrealized_profit
+
+
+class PositionStateStore:
+    """
+    Versioned per-wallet position state for delta sync.
+
+    Each refresh is diffed against the previous state; when anything changed the
+    wallet's version is bumped and the delta kept in a short history. Clients
+    send their last version and get back only what was added, removed or changed
+    since then, or a full resync when that version is no longer in the history
+    or came from another server process.
+
+    Versions look like '<epoch>.<n>': the epoch is unique to this store and n
+    comes from one store-wide sequence, so a version is never reused, even for
+    a wallet that was evicted and rebuilt.
+
+    Wallets are evicted least recently used first once more than ``max_wallets``
+    wallets or ``max_positions`` positions in total are held; the most recently
+    used wallet is always kept.
+    """
+
+    def __init__(self, api, fetch_positions: Callable[[str], Dict[str, Any]], max_history: int = 32,
+                 max_wallets: int = 256, max_positions: int = 200000):
+        self.api = api
+        self.fetch_positions = fetch_positions
+        self.max_history = max_history
+        self.max_wallets = max_wallets
+        self.max_positions = max_positions
+        self._position_count = 0
+        self.epoch = secrets.token_hex(4)
+        self._states: "OrderedDict[str, Dict[str, Any]]" = OrderedDict()
+        self._sequence = 0
+        self._lock = threading.Lock()
+
+    def changes_since(self, user: str, since: Optional[str] = None) -> Dict[str, Any]:
+        result = self.fetch_positions(user)
+        if 'error' in result:
+            return result
+
+        with self._lock:
+            state = self._update(user.lower(), result.get('data', []))
+            since_number = self._parse_version(since)
+            oldest_base = state['history'][0]['base'] if state['history'] else state['version']
+
+            positions = list(state['positions'].values())
+
+            response = {'user': user, 'version': self._format_version(state['version'])}
+            if since_number is None or not oldest_base <= since_number <= state['version']:
+                response.update({'full': True, 'positions': positions})
+            else:
+                response.update({'full': False, **self._merge_deltas(state, since_number)})
+
+        response['totals'] = self._totals(positions)
+        return response
+
+    def _update(self, key: str, positions: list) -> Dict[str, Any]:
+        current = {self._position_key(p): p for p in positions}
+        state = self._states.pop(key, None)
+        if state is None:
+            self._sequence += 1
+            state = {'version': self._sequence, 'positions': current, 'history': deque(maxlen=self.max_history)}
+        else:
+            previous = state['positions']
+            added = current.keys() - previous.keys()
+            removed = previous.keys() - current.keys()
+            changed = {k for k in current.keys() & previous.keys() if current[k] != previous[k]}
+            if added or removed or changed:
+                self._sequence += 1
+                state['history'].append({'base': state['version'], 'version': self._sequence,
+                                         'added': added, 'removed': removed, 'changed': changed})
+                state['version'] = self._sequence
+            self._position_count -= len(previous)
+            state['positions'] = current
+
+        self._states[key] = state
+        self._position_count += len(current)
+        while len(self._states) > 1 and (len(self._states) > self.max_wallets
+                                         or self._position_count > self.max_positions):
+            _, evicted = self._states.popitem(last=False)
+            self._position_count -= len(evicted['positions'])
+        return state
+
+    def _merge_deltas(self, state: Dict[str, Any], since: int) -> Dict[str, Any]:
+        # Whether each touched key existed at `since` is decided by its first delta after it
+        existed_before: Dict[str, bool] = {}
+        for delta in state['history']:
+            if delta['version'] <= since:
+                continue
+            for k in delta['added']:
+                existed_before.setdefault(k, False)
+            for k in delta['removed'] | delta['changed']:
+                existed_before.setdefault(k, True)
+
+        positions = state['positions']
+        added, removed, changed = [], [], []
+        for k, existed in existed_before.items():
+            if k in positions:
+                (changed if existed else added).append(positions[k])
+            elif existed:
+                removed.append(k)
+        return {'added': added, 'removed': removed, 'changed': changed}
+
+    def _totals(self, positions: list) -> Dict[str, Any]:
+        columns = {
+            'initialValue': self.api._float_column(positions, 'initialValue'),
+            'currentValue': self.api._float_column(positions, 'currentValue')
+        }
+        return aggregate_unrealized_profit(columns)
+
+    def _position_key(self, position: Dict[str, Any]) -> str:
+        asset = position.get('asset')
+        if asset:
+            return str(asset)
+        return f"{position.get('conditionId', '')}:{position.get('outcomeIndex', 0)}"
+
+    def _format_version(self, number: int) -> str:
+        return f"{self.epoch}.{number}"
+
+    def _parse_version(self, version: Optional[str]) -> Optional[int]:
+        if not version:
+            return None
+        epoch, _, number = version.partition('.')
+        if epoch != self.epoch or not number.isdigit():
+            return None
+        return int(number)
@@ -0,0 +1,155 @@
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Optional
+
+import numpy as np
+
+from aggregation import aggregate_sector_exposure, aggregate_unrealized_profit
+
+
+class PositionRevaluator:
+    """
+    Keeps each wallet's last position set and refreshes its value from batched
+    market prices instead of paginating /positions again.
+
+    Positions are only re-fetched when the holdings may have changed: no snapshot
+    yet, new activity since the snapshot, or the snapshot is older than ``max_age``
+    seconds. Otherwise curPrice, currentValue and cashPnl are recomputed locally.
+
+    Snapshots are evicted least recently used first once more than ``max_wallets``
+    wallets or ``max_positions`` positions in total are held. The most recently
+    used wallet is always kept, however large.
+    """
+
+    def __init__(self, api, max_age: float = 600, max_wallets: int = 256, max_positions: int = 200000):
+        self.api = api
+        self.max_age = max_age
+        self.max_wallets = max_wallets
+        self.max_positions = max_positions
+        self._snapshots: "OrderedDict[str, Dict[str, Any]]" = OrderedDict()
+        self._position_count = 0
+        self._lock = threading.Lock()
+
+    def get_positions(self, user: str) -> Dict[str, Any]:
+        """
+        Current positions for a user, re-paginated only when needed.
+        Returns 'data', 'sectors' (one per position), 'mode' ('full' or
+        'incremental') and 'pricesUpdated', or the upstream error.
+        """
+        key = user.lower()
+        marker = self._activity_marker(user)
+        with self._lock:
+            snapshot = self._snapshots.get(key)
+
+        if (snapshot is None or marker is None or marker != snapshot['activityMarker']
+                or time.monotonic() - snapshot['fetchedAt'] > self.max_age):
+            snapshot = self._full_refresh(user, marker)
+            if 'error' in snapshot:
+                return snapshot
+            mode, prices_updated = 'full', 0
+        else:
+            snapshot, prices_updated = self._revalue(snapshot)
+            mode = 'incremental'
+
+        with self._lock:
+            previous = self._snapshots.pop(key, None)
+            if previous is not None:
+                self._position_count -= len(previous['positions'])
+            self._snapshots[key] = snapshot
+            self._position_count += len(snapshot['positions'])
+            while len(self._snapshots) > 1 and (len(self._snapshots) > self.max_wallets
+                                                or self._position_count > self.max_positions):
+                _, evicted = self._snapshots.popitem(last=False)
+                self._position_count -= len(evicted['positions'])
+
+        return {
+            'data': snapshot['positions'],
+            'sectors': snapshot['sectors'],
+            'mode': mode,
+            'pricesUpdated': prices_updated
+        }
+
+    def revalue(self, user: str, include_positions: bool = False) -> Dict[str, Any]:
+        """Portfolio value, unrealized profit and sector totals from the latest prices."""
+        result = self.get_positions(user)
+        if 'error' in result:
+            return result
+
+        positions = result['data']
+        sector_names = sorted(set(result['sectors']))
+        sector_codes = {sector: i for i, sector in enumerate(sector_names)}
+        columns = {
+            'initialValue': self.api._float_column(positions, 'initialValue'),
+            'currentValue': self.api._float_column(positions, 'currentValue'),
+            'sector': np.array([sector_codes[s] for s in result['sectors']], dtype=np.int64)
+        }
+
+        response = {
+            'user': user,
+            'mode': result['mode'],
+            'pricesUpdated': result['pricesUpdated'],
+            **aggregate_unrealized_profit(columns),
+            **aggregate_sector_exposure(columns, sector_names)
+        }
+        if include_positions:
+            response['positions'] = positions
+        return response
+
+    def _activity_marker(self, user: str) -> Optional[tuple]:
+        # The newest activity entry changes whenever a trade, redeem or merge lands
+        result = self.api.get_activity(user, limit=1, offset=0)
+        if 'error' in result:
+            return None
+        activity = self.api._extract_list(result)
+        if not activity:
+            return ()
+        latest = activity[0]
+        return (latest.get('timestamp'), latest.get('transactionHash'), latest.get('type'))
+
+    def _full_refresh(self, user: str, marker: Optional[tuple]) -> Dict[str, Any]:
+        result = self.api.get_user_positions(user)
+        if 'error' in result:
+            return result
+        positions = result.get('data', [])
+
+        label_cache = self.api._load_cache()
+        sectors, _ = self.api._get_position_sectors(positions, label_cache)
+        self.api._save_cache(label_cache)
+
+        return {
+            'positions': positions,
+            'sectors': sectors,
+            'activityMarker': marker,
+            'fetchedAt': time.monotonic()
+        }
+
+    def _revalue(self, snapshot: Dict[str, Any]) -> tuple:
+        positions = snapshot['positions']
+        prices = self.api.get_market_prices([self.api._get_condition_id(p) for p in positions])
+
+        updated = []
+        prices_updated = 0
+        for position in positions:
+            outcome_prices = prices.get(self.api._get_condition_id(position))
+            outcome_index = int(self.api._to_float(position.get('outcomeIndex', 0)))
+            if not outcome_prices or outcome_index >= len(outcome_prices):
+                updated.append(position)
+                continue
+
+            cur_price = outcome_prices[outcome_index]
+            current_value = self.api._get_size(position) * cur_price
+            initial_value = self.api._to_float(position.get('initialValue', 0))
+            cash_pnl = current_value - initial_value
+            updated.append({
+                **position,
+                'curPrice': cur_price,
+                'currentValue': current_value,
+                'cashPnl': cash_pnl,
+                'percentPnl': (cash_pnl / initial_value * 100) if initial_value > 0 else 0.0
+            })
+            if cur_price != self.api._get_current_price(position):
+                prices_updated += 1
+
+        # Holdings are unchanged, so the original fetch time still bounds staleness
+        return {**snapshot, 'positions': updated}, prices_updated
@@ -0,0 +1,137 @@
+import numpy as np
+from typing import Optional, Dict, Any, List
+
+
+PERCENTILES = (1, 5, 25, 50, 75, 95, 99)
+
+# Upper bound on the number of cells in one scenario chunk (scenarios x markets).
+# 2M float64 cells keeps the working set around 16MB regardless of wallet size.
+DEFAULT_CHUNK_ELEMENTS = 2_000_000
+
+
+def build_market_book(market_ids: List[str], outcome_index: np.ndarray, size: np.ndarray,
+                      price: np.ndarray, sectors: List[str]) -> Dict[str, Any]:
+    """
+    Collapse positions into one row per market.
+    Each market resolves either to outcome 0 ("yes") or to any other outcome ("no").
+    The held outcome's curPrice is used as its probability of winning.
+    """
+    unique_markets, market_idx = np.unique(np.asarray(market_ids, dtype=object), return_inverse=True)
+    n_markets = len(unique_markets)
+    is_yes = outcome_index == 0
+
+    yes_payout = np.bincount(market_idx, weights=np.where(is_yes, size, 0.0), minlength=n_markets)
+    no_payout = np.bincount(market_idx, weights=np.where(is_yes, 0.0, size), minlength=n_markets)
+
+    # Prefer the price of outcome 0 when it is held, otherwise infer it from the other side
+    p_yes = np.full(n_markets, np.nan)
+    p_yes[market_idx[~is_yes]] = 1.0 - price[~is_yes]
+    p_yes[market_idx[is_yes]] = price[is_yes]
+    p_yes = np.clip(np.nan_to_num(p_yes, nan=0.0), 0.0, 1.0)
+
+    sector_names = sorted(set(sectors))
+    sector_lookup = {name: i for i, name in enumerate(sector_names)}
+    market_sector = np.zeros(n_markets, dtype=np.int64)
+    market_sector[market_idx] = [sector_lookup[s] for s in sectors]
+
+    return {
+        'markets': unique_markets,
+        'marketIndex': market_idx,
+        'pYes': p_yes,
+        'yesPayout': yes_payout,
+        'noPayout': no_payout,
+        'sectorNames': sector_names,
+        'marketSector': market_sector,
+    }
+
+
+def _sector_sum(values: np.ndarray, codes: np.ndarray, n_sectors: int) -> np.ndarray:
+    return np.bincount(codes, weights=values, minlength=n_sectors)
+
+
+def _summarize(values: np.ndarray, cost: float) -> Dict[str, Any]:
+    pnl = values - cost
+    percentiles = np.percentile(pnl, PERCENTILES)
+    return {
+        'meanPnL': round(float(pnl.mean()), 2),
+        'stdPnL': round(float(pnl.std()), 2),
+        'probabilityOfLoss': round(float((pnl < 0).mean()), 4),
+        'percentiles': {f'p{q}': round(float(v), 2) for q, v in zip(PERCENTILES, percentiles)},
+    }
+
+
+def simulate_resolution_pnl(market_ids: List[str], outcome_index: np.ndarray, size: np.ndarray,
+                            price: np.ndarray, cost: np.ndarray, value: np.ndarray, sectors: List[str],
+                            scenarios: int = 100_000, seed: Optional[int] = None,
+                            chunk_elements: int = DEFAULT_CHUNK_ELEMENTS) -> Dict[str, Any]:
+    """
+    Monte Carlo PnL distribution under independent resolution of every open market.
+
+    Every scenario draws one resolution per market and pays 1 per winning share.
+    The scenario matrix is processed in chunks of at most ``chunk_elements`` cells,
+    so memory stays bounded for wallets with thousands of markets.
+    Best and worst cases are exact, not sampled.
+    """
+    book = build_market_book(market_ids, outcome_index, size, price, sectors)
+    sector_names = book['sectorNames']
+    n_sectors = len(sector_names)
+    n_markets = len(book['markets'])
+    market_sector = book['marketSector']
+
+    yes_payout = book['yesPayout']
+    no_payout = book['noPayout']
+    p_yes = book['pYes']
+
+    position_sector = market_sector[book['marketIndex']]
+    sector_cost = _sector_sum(cost, position_sector, n_sectors)
+    sector_value = _sector_sum(value, position_sector, n_sectors)
+
+    # Exact moments and extremes, per market then per sector
+    expected = p_yes * yes_payout + (1.0 - p_yes) * no_payout
+    best = np.maximum(yes_payout, no_payout)
+    worst = np.minimum(yes_payout, no_payout)
+    sector_expected = _sector_sum(expected, market_sector, n_sectors)
+    sector_best = _sector_sum(best, market_sector, n_sectors)
+    sector_worst = _sector_sum(worst, market_sector, n_sectors)
+
+    # Scenario value = sum(no payouts) + sum over markets resolving "yes" of (yes - no)
+    delta_by_sector = np.zeros((n_markets, n_sectors))
+    delta_by_sector[np.arange(n_markets), market_sector] = yes_payout - no_payout
+    sector_base = _sector_sum(no_payout, market_sector, n_sectors)
+
+    rng = np.random.default_rng(seed)
+    scenario_sector_values = np.empty((scenarios, n_sectors))
+    chunk_rows = max(1, min(scenarios, chunk_elements // max(n_markets, 1)))
+    for start in range(0, scenarios, chunk_rows):
+        stop = min(start + chunk_rows, scenarios)
+        resolves_yes = rng.random((stop - start, n_markets)) < p_yes
+        scenario_sector_values[start:stop] = sector_base + resolves_yes.astype(np.float64) @ delta_by_sector
+
+    scenario_values = scenario_sector_values.sum(axis=1)
+    total_cost = float(cost.sum())
+
+    sector_results = []
+    for i, name in enumerate(sector_names):
+        sector_results.append({
+            'sector': name,
+            'totalCost': round(float(sector_cost[i]), 2),
+            'currentValue': round(float(sector_value[i]), 2),
+            'expectedValue': round(float(sector_expected[i]), 2),
+            'bestCase': {'value': round(float(sector_best[i]), 2), 'pnl': round(float(sector_best[i] - sector_cost[i]), 2)},
+            'worstCase': {'value': round(float(sector_worst[i]), 2), 'pnl': round(float(sector_worst[i] - sector_cost[i]), 2)},
+            'distribution': _summarize(scenario_sector_values[:, i], float(sector_cost[i])),
+        })
+    sector_results.sort(key=lambda s: s['currentValue'], reverse=True)
+
+    return {
+        'scenarios': scenarios,
+        'marketsCount': n_markets,
+        'totalCost': round(total_cost, 2),
+        'currentValue': round(float(value.sum()), 2),
+        'expectedValue': round(float(expected.sum()), 2),
+        'expectedPnL': round(float(expected.sum()) - total_cost, 2),
+        'bestCase': {'value': round(float(best.sum()), 2), 'pnl': round(float(best.sum()) - total_cost, 2)},
+        'worstCase': {'value': round(float(worst.sum()), 2), 'pnl': round(float(worst.sum()) - total_cost, 2)},
+        'distribution': _summarize(scenario_values, total_cost),
+        'sectors': sector_results,
+    }
@@ -0,0 +1,222 @@
+import asyncio
+import contextvars
+import math
+import os
+import threading
+import time
+from collections import OrderedDict, deque
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, Optional, Tuple
+
+
+# Process-wide cap on concurrent upstream HTTP calls, shared by every request
+UPSTREAM_CONCURRENCY = int(os.getenv("UPSTREAM_CONCURRENCY", "16"))
+
+_upstream_slots = threading.BoundedSemaphore(UPSTREAM_CONCURRENCY)
+
+# Per-request cap, installed by FairScheduler.run for the duration of one job
+_request_slots: contextvars.ContextVar[Optional[threading.BoundedSemaphore]] = contextvars.ContextVar(
+    "request_upstream_slots", default=None
+)
+
+
+@contextmanager
+def upstream_slot():
+    """
+    Hold one upstream connection slot for the duration of an HTTP call.
+    Takes the calling request's own slot first, so a single request can never
+    claim more than its share of the process-wide pool.
+    """
+    request_slots = _request_slots.get()
+    if request_slots is not None:
+        request_slots.acquire()
+    try:
+        with _upstream_slots:
+            yield
+    finally:
+        if request_slots is not None:
+            request_slots.release()
+
+
+class SchedulerBusy(Exception):
+    """Raised when a job cannot be queued; carries a Retry-After hint in seconds."""
+
+    def __init__(self, retry_after: int, reason: str):
+        super().__init__(reason)
+        self.retry_after = retry_after
+        self.reason = reason
+
+
+class FairScheduler:
+    """
+    Admission control between the API routes and PolymarketAPI.
+
+    Jobs are queued per wallet and dispatched round-robin across wallets, so a
+    wallet with many slow requests in flight cannot push a small wallet's request
+    to the back of one long line. While other wallets are waiting, a wallet may
+    hold at most ``max_active_per_wallet`` worker slots; when nobody else is
+    queued it may take more, but ``reserved_slots`` slots are always left free
+    so a newly arriving wallet is dispatched at once. Each job may make at most
+    ``upstream_per_request`` concurrent upstream calls. When queues are deep,
+    new jobs are rejected with a Retry-After estimate instead of piling up.
+    """
+
+    def __init__(self, max_active: int = 8, max_active_per_wallet: int = 2, max_queue: int = 64,
+                 max_wallet_queue: int = 16, upstream_per_request: int = 4, reserved_slots: int = 1):
+        self.max_active = max_active
+        self.max_active_per_wallet = max_active_per_wallet
+        self.reserved_slots = reserved_slots
+        self.max_queue = max_queue
+        self.max_wallet_queue = max_wallet_queue
+        self.upstream_per_request = upstream_per_request
+
+        self._queues: "OrderedDict[str, deque]" = OrderedDict()
+        self._active_by_key: Dict[str, int] = {}
+        self._active = 0
+        self._queued = 0
+
+        self._avg_job_seconds = 1.0
+        self._recent_waits: deque = deque(maxlen=512)
+        self._completed = 0
+        self._rejected = 0
+
+    async def run(self, key: str, func: Callable, *args: Any) -> Tuple[Any, float]:
+        """
+        Queue ``func(*args)`` under ``key`` and run it in a worker thread once dispatched.
+        Returns the result and the time in seconds the job spent waiting in the queue.
+        """
+        wait = await self.acquire(key)
+        started_at = time.monotonic()
+        try:
+            result = await asyncio.to_thread(self.request_context().run, func, *args)
+        finally:
+            self.release(key, time.monotonic() - started_at)
+        return result, wait
+
+    async def acquire(self, key: str) -> float:
+        """
+        Wait for a worker slot under ``key`` and return the time spent queued.
+        Every successful acquire must be paired with exactly one ``release``;
+        use this directly only for work that outlives a single call, like a stream.
+        """
+        key = (key or "").lower()
+        self._admit(key)
+
+        granted = asyncio.get_running_loop().create_future()
+        self._queues.setdefault(key, deque()).append(granted)
+        self._queued += 1
+        enqueued_at = time.monotonic()
+        self._dispatch()
+
+        try:
+            await granted
+        except asyncio.CancelledError:
+            if granted.done() and not granted.cancelled():
+                self.release(key, 0.0)
+            else:
+                self._discard(key, granted)
+            raise
+
+        wait = time.monotonic() - enqueued_at
+        self._recent_waits.append(wait)
+        return wait
+
+    def request_context(self) -> contextvars.Context:
+        """A copy of the current context carrying a fresh per-request upstream budget."""
+        context = contextvars.copy_context()
+        context.run(_request_slots.set, threading.BoundedSemaphore(self.upstream_per_request))
+        return context
+
+    def stats(self) -> Dict[str, Any]:
+        waits = sorted(self._recent_waits)
+
+        def percentile(q: float) -> float:
+            if not waits:
+                return 0.0
+            return waits[min(len(waits) - 1, int(q * len(waits)))]
+
+        return {
+            'active': self._active,
+            'queued': self._queued,
+            'queuedWallets': sum(1 for q in self._queues.values() if q),
+            'completed': self._completed,
+            'rejected': self._rejected,
+            'avgJobMs': round(self._avg_job_seconds * 1000, 1),
+            'queueWaitMs': {
+                'p50': round(percentile(0.50) * 1000, 1),
+                'p95': round(percentile(0.95) * 1000, 1),
+                'max': round((waits[-1] if waits else 0.0) * 1000, 1)
+            }
+        }
+
+    def _admit(self, key: str):
+        wallet_queue = self._queues.get(key)
+        if self._queued >= self.max_queue:
+            reason = "Server is busy, too many queued requests"
+        elif wallet_queue is not None and len(wallet_queue) >= self.max_wallet_queue:
+            reason = "Too many queued requests for this wallet"
+        else:
+            return
+        self._rejected += 1
+        raise SchedulerBusy(self._retry_after(), reason)
+
+    def _retry_after(self) -> int:
+        # Time for the current backlog to drain through the worker slots
+        backlog = (self._queued + self._active) / max(self.max_active, 1)
+        return max(1, min(60, math.ceil(backlog * self._avg_job_seconds)))
+
+    def _next_key(self) -> Optional[str]:
+        over_cap = None
+        for key in list(self._queues):
+            queue = self._queues[key]
+            while queue and queue[0].cancelled():
+                queue.popleft()
+                self._queued -= 1
+            if not queue:
+                if not self._active_by_key.get(key):
+                    del self._queues[key]
+                continue
+            if self._active_by_key.get(key, 0) >= self.max_active_per_wallet:
+                over_cap = over_cap or key
+                continue
+            # Round-robin: the served wallet goes to the back of the rotation
+            self._queues.move_to_end(key)
+            return key
+        # Past its cap a wallet may only use idle slots beyond the reserve kept for newcomers
+        if over_cap is None or self._active >= self.max_active - self.reserved_slots:
+            return None
+        self._queues.move_to_end(over_cap)
+        return over_cap
+
+    def _dispatch(self):
+        while self._active < self.max_active:
+            key = self._next_key()
+            if key is None:
+                return
+            granted = self._queues[key].popleft()
+            self._queued -= 1
+            self._active += 1
+            self._active_by_key[key] = self._active_by_key.get(key, 0) + 1
+            granted.set_result(None)
+
+    def _discard(self, key: str, granted: asyncio.Future):
+        queue = self._queues.get(key)
+        if queue is not None and granted in queue:
+            queue.remove(granted)
+            self._queued -= 1
+
+    def release(self, key: str, duration: float):
+        """Give back a slot taken by ``acquire``; ``duration`` feeds the Retry-After estimate."""
+        key = (key or "").lower()
+        self._active -= 1
+        remaining = self._active_by_key.get(key, 1) - 1
+        if remaining:
+            self._active_by_key[key] = remaining
+        else:
+            self._active_by_key.pop(key, None)
+            if key in self._queues and not self._queues[key]:
+                del self._queues[key]
+        if duration > 0:
+            self._completed += 1
+            self._avg_job_seconds = 0.8 * self._avg_job_seconds + 0.2 * duration
+        self._dispatch()
@@ -0,0 +1,90 @@
+import unittest
+from unittest.mock import patch
+from datetime import datetime
+from polymarket_api import PolymarketAPI
+from aggregation import AggregationDispatcher
+
+
+class TestAggregationDispatch(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        # One pooled dispatcher shared by the class so workers are spawned once
+        cls.pooled = AggregationDispatcher(inline_max_rows=0, workers=1)
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.pooled.shutdown()
+
+    def setUp(self):
+        self.api = PolymarketAPI()
+        self.test_user = "0x1234567890123456789012345678901234567890"
+        self.closed_positions = [
+            {'realizedPnl': 100.0, 'timestamp': int(datetime(2024, 1, 15).timestamp())},
+            {'realizedPnl': -25.5, 'timestamp': int(datetime(2024, 1, 20).timestamp())},
+            {'realizedPnl': 40.0, 'timestamp': int(datetime(2024, 3, 2).timestamp())}
+        ]
+        self.positions = [
+            {'slug': 'a', 'size': 10.0, 'avgPrice': 0.5, 'curPrice': 0.6, 'initialValue': 5.0, 'currentValue': 6.0},
+            {'slug': 'b', 'size': 20.0, 'avgPrice': 0.4, 'curPrice': 0.3, 'initialValue': 8.0, 'currentValue': 6.0},
+            {'slug': 'a', 'size': 5.0, 'avgPrice': 0.2, 'curPrice': 0.5, 'initialValue': 1.0, 'currentValue': 2.5}
+        ]
+
+    def _both(self, method, *args):
+        with patch.object(self.api, 'get_closed_positions', return_value=self.closed_positions), \
+             patch.object(self.api, 'get_user_positions', return_value={'data': self.positions, 'count': 3}), \
+             patch.object(self.api, '_load_cache', return_value={'a': 'Politics', 'b': 'Sports'}), \
+             patch.object(self.api, '_save_cache'):
+            inline = getattr(self.api, method)(self.test_user, *args)
+            self.api.aggregator = self.pooled
+            pooled = getattr(self.api, method)(self.test_user, *args)
+        return inline, pooled
+
+    def test_pnl_history_same_inline_and_pooled(self):
+        inline, pooled = self._both('calculate_pnl_history', 'monthly')
+
+        self.assertEqual(inline, pooled)
+        self.assertEqual(inline['data'][0], {'date': '2024-01', 'pnl': 74.5, 'cumulativePnL': 74.5})
+        self.assertEqual(inline['data'][1]['date'], '2024-03')
+
+    def test_pnl_history_threshold_counts_closed_rows(self):
+        self.positions = self.positions * 1000
+        dispatcher = AggregationDispatcher(inline_max_rows=10, workers=1)
+        self.api.aggregator = dispatcher
+        with patch.object(dispatcher, '_get_pool') as pool_mock, \
+             patch.object(self.api, 'get_closed_positions', return_value=self.closed_positions), \
+             patch.object(self.api, 'get_user_positions', return_value={'data': self.positions}):
+            self.api.calculate_pnl_history(self.test_user)
+
+        # Thousands of open positions only feed one inline sum, so three closed rows stay inline
+        pool_mock.assert_not_called()
+
+    def test_warm_starts_every_worker(self):
+        dispatcher = AggregationDispatcher(workers=2)
+        self.addCleanup(dispatcher.shutdown)
+        dispatcher.warm()
+
+        self.assertEqual(len(dispatcher._pool._processes), 2)
+
+    def test_unrealized_profit_is_always_inline(self):
+        with patch.object(self.pooled, 'run') as run_mock:
+            inline, pooled = self._both('calculate_unrealized_profit')
+
+        run_mock.assert_not_called()
+        self.assertEqual(inline, pooled)
+        self.assertAlmostEqual(inline['totalCost'], 14.0, places=2)
+        self.assertAlmostEqual(inline['unrealizedProfit'], 0.5, places=2)
+        self.assertEqual(inline['positionsCount'], 3)
+
+    def test_sector_exposure_is_always_inline(self):
+        with patch.object(self.pooled, 'run') as run_mock:
+            inline, pooled = self._both('calculate_sector_exposure')
+
+        run_mock.assert_not_called()
+        self.assertEqual(inline['sectors'], pooled['sectors'])
+        self.assertEqual(inline['sectors'][0], {'sector': 'Politics', 'value': 8.5, 'percentage': 58.62})
+        self.assertAlmostEqual(inline['totalValue'], 14.5, places=2)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,165 @@
+import asyncio
+import csv
+import io
+import unittest
+from unittest.mock import patch
+from fastapi.testclient import TestClient
+import main
+import scheduler
+from export import ExportError, main as export_main, parquet_available, stream_parquet
+from scheduler import SchedulerBusy
+
+TEST_USER = "0x1234567890123456789012345678901234567890"
+
+
+def fake_pages(pages):
+    def iter_pages(endpoint, params, limit=500, offset=0):
+        yield from pages
+    return iter_pages
+
+
+class TestExport(unittest.TestCase):
+
+    def setUp(self):
+        self.client = TestClient(main.app)
+        self.pages = [
+            [{'timestamp': 1700000000, 'type': 'TRADE', 'side': 'BUY', 'size': '10', 'price': 0.5, 'outcomeIndex': 0, 'extra': 'dropped'}],
+            [{'timestamp': 1700000100000, 'type': 'REDEEM', 'size': 4}]
+        ]
+
+    def _export(self, url):
+        with patch('main.polymarket_api.iter_pages', side_effect=fake_pages(self.pages)):
+            return self.client.get(url)
+
+    def test_csv_export_normalizes_columns(self):
+        response = self._export(f"/api/export?user={TEST_USER}&dataset=activity&format=csv")
+
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('attachment', response.headers['content-disposition'])
+        rows = list(csv.DictReader(io.StringIO(response.text)))
+        self.assertEqual(len(rows), 2)
+        self.assertNotIn('extra', rows[0])
+        self.assertEqual(rows[0]['size'], '10.0')
+        self.assertEqual(rows[1]['timestamp'], '1700000100')
+        self.assertEqual(rows[1]['side'], '')
+
+    def test_upstream_error_before_streaming(self):
+        self.pages = [{'error': 'Bad Request', 'status_code': 400}]
+        response = self._export(f"/api/export?user={TEST_USER}&dataset=positions")
+
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(main.export_scheduler.stats()['active'], 0)
+
+    def test_export_holds_an_export_slot_while_streaming(self):
+        seen = []
+
+        def iter_pages(endpoint, params, limit=500, offset=0):
+            # Every page is fetched with the request's upstream budget and its scheduler slot held
+            for page in self.pages:
+                seen.append((scheduler._request_slots.get() is not None, main.export_scheduler.stats()['active'],
+                             main.scheduler.stats()['active']))
+                yield page
+
+        completed = main.export_scheduler.stats()['completed']
+        with patch('main.polymarket_api.iter_pages', side_effect=iter_pages):
+            response = self.client.get(f"/api/export?user={TEST_USER}&dataset=activity")
+
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('X-Queue-Wait-Ms', response.headers)
+        # Exports run in their own pool and leave the request scheduler's slots free
+        self.assertEqual(seen, [(True, 1, 0), (True, 1, 0)])
+        self.assertEqual(main.export_scheduler.stats()['active'], 0)
+        self.assertEqual(main.export_scheduler.stats()['completed'], completed + 1)
+
+    def test_one_wallet_cannot_take_every_export_slot(self):
+        async def second_export_waits():
+            await main.export_scheduler.acquire(TEST_USER)
+            second = asyncio.create_task(main.export_scheduler.acquire(TEST_USER))
+            await asyncio.sleep(0.01)
+            waited = not second.done()
+            main.export_scheduler.release(TEST_USER, 0.0)
+            await second
+            main.export_scheduler.release(TEST_USER, 0.0)
+            return waited
+
+        self.assertTrue(asyncio.run(second_export_waits()))
+        self.assertEqual(main.export_scheduler.stats()['active'], 0)
+
+    def test_busy_export_returns_429(self):
+        with patch.object(main.export_scheduler, 'acquire', side_effect=SchedulerBusy(5, 'busy')):
+            response = self._export(f"/api/export?user={TEST_USER}&dataset=activity")
+
+        self.assertEqual(response.status_code, 429)
+        self.assertEqual(response.headers['Retry-After'], '5')
+
+    def test_filename_is_sanitized(self):
+        for user in ('a"b', 'café☃'):
+            response = self._export(f"/api/export?user={user}&dataset=activity")
+
+            self.assertEqual(response.status_code, 200)
+            self.assertRegex(response.headers['content-disposition'], r'^attachment; filename="[0-9A-Za-z_-]+-activity\.csv"$')
+
+    def test_upstream_error_before_first_chunk_keeps_its_status(self):
+        def failing_stream():
+            raise ExportError({'error': 'Bad Gateway', 'status_code': 502})
+            yield b''
+
+        with patch('main.open_export', return_value=failing_stream()):
+            response = self.client.get(f"/api/export?user={TEST_USER}&dataset=activity&format=parquet")
+
+        self.assertEqual(response.status_code, 502)
+        self.assertEqual(main.export_scheduler.stats()['active'], 0)
+
+    @unittest.skipUnless(parquet_available(), "pyarrow is not installed")
+    def test_parquet_flushes_the_first_page(self):
+        def pages():
+            yield [(1700000000, 'TRADE') + (None,) * 11]
+            raise ExportError({'error': 'Bad Gateway', 'status_code': 502})
+
+        stream = stream_parquet(pages(), 'activity')
+
+        self.assertTrue(next(stream).startswith(b'PAR1'))
+        with self.assertRaises(ExportError):
+            next(stream)
+
+    def test_invalid_dataset(self):
+        self.assertEqual(self.client.get(f"/api/export?user={TEST_USER}&dataset=orders").status_code, 422)
+
+    @unittest.skipUnless(parquet_available(), "pyarrow is not installed")
+    def test_parquet_export_has_typed_columns(self):
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+
+        response = self._export(f"/api/export?user={TEST_USER}&dataset=activity&format=parquet")
+
+        self.assertEqual(response.status_code, 200)
+        table = pq.read_table(io.BytesIO(response.content))
+        self.assertEqual(table.num_rows, 2)
+        self.assertEqual(table.schema.field('size').type, pa.float64())
+        self.assertEqual(table.schema.field('outcomeIndex').type, pa.int64())
+        self.assertEqual(table.column('type').to_pylist(), ['TRADE', 'REDEEM'])
+
+    def test_cli_writes_every_dataset(self):
+        import tempfile
+        with tempfile.TemporaryDirectory() as tmp, \
+             patch('export.PolymarketAPI.iter_pages', side_effect=lambda *args, **kwargs: iter(self.pages)):
+            export_main(['--user', TEST_USER, '--output-dir', tmp])
+            with open(f"{tmp}/{TEST_USER}-closed-positions.csv") as f:
+                self.assertEqual(len(f.read().splitlines()), 3)
+
+
+    def test_cli_removes_partial_file_on_upstream_error(self):
+        import os
+        import tempfile
+        self.pages.append({'error': 'Bad Gateway', 'status_code': 502})
+        with tempfile.TemporaryDirectory() as tmp, \
+             patch('export.PolymarketAPI.iter_pages', side_effect=lambda *args, **kwargs: iter(self.pages)):
+            with self.assertRaises(SystemExit) as ctx:
+                export_main(['--user', TEST_USER, '--dataset', 'activity', '--output-dir', tmp])
+
+            self.assertEqual(str(ctx.exception), 'Error exporting activity: Bad Gateway')
+            self.assertEqual(os.listdir(tmp), [])
+
+
+if __name__ == '__main__':
+    unittest.main()
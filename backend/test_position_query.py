@@ -0,0 +1,79 @@
+import pytest
+from fastapi.testclient import TestClient
+from unittest.mock import patch
+from main import app
+
+client = TestClient(app)
+TEST_USER = "0x1234567890123456789012345678901234567890"
+
+POSITIONS = {
+    'data': [
+        {'conditionId': 'c1', 'slug': 'fed-cut', 'title': 'Fed cut?', 'currentValue': 120.0, 'size': 200.0},
+        {'conditionId': 'c2', 'slug': 'nba-finals', 'title': 'NBA Finals', 'currentValue': 0.5, 'size': 1.0},
+        {'conditionId': 'c3', 'slug': 'btc-100k', 'title': 'BTC 100k', 'currentValue': 45.0, 'size': 90.0},
+        {'conditionId': 'c4', 'slug': 'election', 'title': 'Election', 'size': 10.0}
+    ],
+    'count': 4
+}
+LABELS = {'fed-cut': 'Economy', 'nba-finals': 'Sports', 'btc-100k': 'Crypto', 'election': 'Politics'}
+
+
+class TestPositionQuery:
+
+    def _get(self, url):
+        with patch('main.polymarket_api.get_user_positions', return_value=POSITIONS), \
+             patch('main.polymarket_api._load_cache', return_value=dict(LABELS)), \
+             patch('main.polymarket_api._save_cache'):
+            return client.get(url)
+
+    def test_no_params_returns_unchanged_response(self):
+        response = self._get(f"/api/positions?user={TEST_USER}")
+
+        assert response.status_code == 200
+        assert response.json() == POSITIONS
+
+    def test_min_value_sort_and_projection(self):
+        response = self._get(f"/api/positions?user={TEST_USER}&min_value=1&sort=currentValue&order=asc&fields=slug,currentValue")
+
+        assert response.status_code == 200
+        data = response.json()
+        assert data['data'] == [{'slug': 'btc-100k', 'currentValue': 45.0}, {'slug': 'fed-cut', 'currentValue': 120.0}]
+        assert data['total'] == 2
+
+    def test_sort_puts_missing_values_last(self):
+        response = self._get(f"/api/positions?user={TEST_USER}&sort=currentValue&fields=slug")
+
+        assert [p['slug'] for p in response.json()['data']] == ['fed-cut', 'btc-100k', 'nba-finals', 'election']
+
+    def test_sector_and_market_filters(self):
+        response = self._get(f"/api/positions?user={TEST_USER}&sector=crypto,Sports&fields=slug,sector")
+        assert response.json()['data'] == [{'slug': 'nba-finals', 'sector': 'Sports'}, {'slug': 'btc-100k', 'sector': 'Crypto'}]
+
+        response = self._get(f"/api/positions?user={TEST_USER}&market=c1,election&fields=conditionId")
+        assert response.json()['data'] == [{'conditionId': 'c1'}, {'conditionId': 'c4'}]
+
+    def test_pagination(self):
+        response = self._get(f"/api/positions?user={TEST_USER}&sort=size&limit=3&page=2&fields=slug")
+
+        data = response.json()
+        assert data['data'] == [{'slug': 'nba-finals'}]
+        assert data['total'] == 4
+        assert data['page'] == 2
+        assert data['count'] == 1
+
+    def test_closed_positions_min_value_uses_amount_invested(self):
+        closed = [{'slug': 'a', 'totalBought': 100.0, 'avgPrice': 0.5}, {'slug': 'b', 'totalBought': 4.0, 'avgPrice': 0.5}]
+        with patch('main.polymarket_api.get_closed_positions', return_value=closed):
+            response = client.get(f"/api/closed-positions?user={TEST_USER}&min_value=10&fields=slug")
+
+        assert response.json()['data'] == [{'slug': 'a'}]
+
+    def test_page_without_limit_is_rejected(self):
+        assert self._get(f"/api/positions?user={TEST_USER}&page=3").status_code == 422
+
+    def test_invalid_order(self):
+        assert self._get(f"/api/positions?user={TEST_USER}&sort=size&order=up").status_code == 422
+
+
+if __name__ == '__main__':
+    pytest.main([__file__, '-v'])
@@ -0,0 +1,78 @@
+import unittest
+from polymarket_api import PolymarketAPI
+from position_sync import PositionStateStore
+
+
+class TestPositionDeltaSync(unittest.TestCase):
+
+    def setUp(self):
+        self.api = PolymarketAPI()
+        self.test_user = "0x1234567890123456789012345678901234567890"
+        self.positions = [
+            {'asset': 't1', 'initialValue': 10.0, 'currentValue': 12.0},
+            {'asset': 't2', 'initialValue': 5.0, 'currentValue': 4.0}
+        ]
+        self.store = PositionStateStore(self.api, lambda user: {'data': list(self.positions)}, max_history=2)
+
+    def test_first_sync_is_full(self):
+        result = self.store.changes_since(self.test_user)
+
+        self.assertTrue(result['full'])
+        self.assertEqual(len(result['positions']), 2)
+        self.assertAlmostEqual(result['totals']['currentValue'], 16.0, places=2)
+
+    def test_unchanged_positions_return_empty_delta(self):
+        version = self.store.changes_since(self.test_user)['version']
+        result = self.store.changes_since(self.test_user, version)
+
+        self.assertFalse(result['full'])
+        self.assertEqual(result['version'], version)
+        self.assertEqual((result['added'], result['removed'], result['changed']), ([], [], []))
+
+    def test_delta_merges_changes_since_client_version(self):
+        version = self.store.changes_since(self.test_user)['version']
+        self.positions = [{'asset': 't1', 'initialValue': 10.0, 'currentValue': 15.0},
+                          {'asset': 't3', 'initialValue': 1.0, 'currentValue': 1.0}]
+        self.store.changes_since(self.test_user, version)
+        self.positions.append({'asset': 't2', 'initialValue': 5.0, 'currentValue': 4.0})
+        result = self.store.changes_since(self.test_user, version)
+
+        # t2 was removed and re-added unchanged, so it is reported as changed against the client's copy
+        self.assertFalse(result['full'])
+        self.assertEqual([p['asset'] for p in result['added']], ['t3'])
+        self.assertEqual(sorted(p['asset'] for p in result['changed']), ['t1', 't2'])
+        self.assertEqual(result['removed'], [])
+        self.assertAlmostEqual(result['totals']['currentValue'], 20.0, places=2)
+
+    def test_removed_positions_are_reported_by_key(self):
+        version = self.store.changes_since(self.test_user)['version']
+        self.positions = self.positions[:1]
+        result = self.store.changes_since(self.test_user, version)
+
+        self.assertEqual(result['removed'], ['t2'])
+
+    def test_expired_or_foreign_version_forces_full_resync(self):
+        version = self.store.changes_since(self.test_user)['version']
+        for value in (20.0, 21.0, 22.0):
+            self.positions = [{'asset': 't1', 'initialValue': 10.0, 'currentValue': value}]
+            self.store.changes_since(self.test_user)
+
+        self.assertTrue(self.store.changes_since(self.test_user, version)['full'])
+        self.assertTrue(self.store.changes_since(self.test_user, 'deadbeef.1')['full'])
+
+    def test_state_is_bounded_by_total_positions(self):
+        store = PositionStateStore(self.api, lambda user: {'data': list(self.positions)}, max_positions=3)
+        store.changes_since('0xaaa')
+        store.changes_since('0xbbb')
+
+        self.assertEqual(list(store._states), ['0xbbb'])
+        self.assertEqual(store._position_count, 2)
+
+    def test_upstream_error_is_returned(self):
+        store = PositionStateStore(self.api, lambda user: {'error': 'API error', 'status_code': 500})
+
+        self.assertIn('error', store.changes_since(self.test_user))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,87 @@
+import unittest
+from unittest.mock import patch, MagicMock
+from polymarket_api import PolymarketAPI
+from revaluation import PositionRevaluator
+
+
+class TestPositionRevaluation(unittest.TestCase):
+
+    def setUp(self):
+        self.api = PolymarketAPI()
+        self.revaluator = PositionRevaluator(self.api)
+        self.test_user = "0x1234567890123456789012345678901234567890"
+        self.positions = {'data': [
+            {'conditionId': 'c1', 'outcomeIndex': 0, 'size': 100.0, 'curPrice': 0.5, 'initialValue': 40.0, 'currentValue': 50.0, 'slug': 'a'},
+            {'conditionId': 'c2', 'outcomeIndex': 1, 'size': 10.0, 'curPrice': 0.2, 'initialValue': 5.0, 'currentValue': 2.0, 'slug': 'b'}
+        ], 'count': 2}
+        self.activity = [{'timestamp': 1700000000, 'transactionHash': '0xabc', 'type': 'TRADE'}]
+        patchers = [
+            patch.object(self.api, '_load_cache', return_value={'a': 'Politics', 'b': 'Sports'}),
+            patch.object(self.api, '_save_cache')
+        ]
+        for p in patchers:
+            p.start()
+            self.addCleanup(p.stop)
+
+    def _revalue(self, prices=None):
+        with patch.object(self.api, 'get_activity', return_value=self.activity), \
+             patch.object(self.api, 'get_user_positions', return_value=self.positions) as positions_mock, \
+             patch.object(self.api, 'get_market_prices', return_value=prices or {}) as prices_mock:
+            result = self.revaluator.revalue(self.test_user, include_positions=True)
+        return result, positions_mock, prices_mock
+
+    def test_first_call_paginates_positions(self):
+        result, positions_mock, prices_mock = self._revalue()
+
+        self.assertEqual(result['mode'], 'full')
+        self.assertAlmostEqual(result['currentValue'], 52.0, places=2)
+        positions_mock.assert_called_once()
+        prices_mock.assert_not_called()
+
+    def test_refresh_without_new_activity_uses_prices_only(self):
+        self._revalue()
+        result, positions_mock, prices_mock = self._revalue({'c1': [0.7, 0.3], 'c2': [0.6, 0.4]})
+
+        self.assertEqual(result['mode'], 'incremental')
+        positions_mock.assert_not_called()
+        prices_mock.assert_called_once_with(['c1', 'c2'])
+        self.assertEqual(result['pricesUpdated'], 2)
+        self.assertAlmostEqual(result['currentValue'], 74.0, places=2)
+        self.assertAlmostEqual(result['unrealizedProfit'], 29.0, places=2)
+        self.assertEqual(result['sectors'][0], {'sector': 'Politics', 'value': 70.0, 'percentage': 94.59})
+        self.assertAlmostEqual(result['positions'][1]['cashPnl'], -1.0, places=6)
+
+    def test_new_activity_triggers_full_refresh(self):
+        self._revalue()
+        self.activity = [{'timestamp': 1700000500, 'transactionHash': '0xdef', 'type': 'TRADE'}]
+        result, positions_mock, _ = self._revalue({'c1': [0.7, 0.3]})
+
+        self.assertEqual(result['mode'], 'full')
+        positions_mock.assert_called_once()
+
+    def test_snapshots_are_bounded_by_total_positions(self):
+        revaluator = PositionRevaluator(self.api, max_positions=3)
+        with patch.object(self.api, 'get_activity', return_value=self.activity), \
+             patch.object(self.api, 'get_user_positions', return_value=self.positions):
+            revaluator.get_positions('0xaaa')
+            revaluator.get_positions('0xbbb')
+
+        self.assertEqual(list(revaluator._snapshots), ['0xbbb'])
+        self.assertEqual(revaluator._position_count, 2)
+
+    def test_market_prices_are_batched(self):
+        self.api.PRICE_BATCH_SIZE = 2
+        response = MagicMock()
+        response.json.side_effect = [
+            [{'conditionId': 'c1', 'outcomePrices': '["0.7", "0.3"]'}, {'conditionId': 'c2', 'outcomePrices': ['0.1', '0.9']}],
+            [{'conditionId': 'c3', 'outcomePrices': '["1", "0"]'}]
+        ]
+        with patch.object(self.api.session, 'get', return_value=response) as get_mock:
+            prices = self.api.get_market_prices(['c1', 'c2', 'c1', 'c3'])
+
+        self.assertEqual(get_mock.call_count, 2)
+        self.assertEqual(prices, {'c1': [0.7, 0.3], 'c2': [0.1, 0.9], 'c3': [1.0, 0.0]})
+
+
+if __name__ == '__main__':
+    unittest.main()
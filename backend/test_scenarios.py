@@ -0,0 +1,68 @@
+import unittest
+from unittest.mock import patch
+import numpy as np
+from polymarket_api import PolymarketAPI
+from scenario_engine import simulate_resolution_pnl
+
+
+class TestScenarioEngine(unittest.TestCase):
+
+    def setUp(self):
+        self.api = PolymarketAPI()
+        self.test_user = "0x1234567890123456789012345678901234567890"
+        self.positions = [
+            {'conditionId': 'cond1', 'outcomeIndex': 0, 'size': 100.0, 'curPrice': 0.6, 'initialValue': 50.0, 'currentValue': 60.0, 'slug': 'a'},
+            {'conditionId': 'cond1', 'outcomeIndex': 1, 'size': 20.0, 'curPrice': 0.4, 'initialValue': 10.0, 'currentValue': 8.0, 'slug': 'a'},
+            {'conditionId': 'cond2', 'outcomeIndex': 1, 'size': 50.0, 'curPrice': 0.5, 'initialValue': 20.0, 'currentValue': 25.0, 'slug': 'b'}
+        ]
+
+    def _run(self, scenarios=20000, seed=7):
+        with patch.object(self.api, 'get_user_positions', return_value={'data': self.positions, 'count': 3}), \
+             patch.object(self.api, '_load_cache', return_value={'a': 'Politics', 'b': 'Sports'}), \
+             patch.object(self.api, '_save_cache'):
+            return self.api.calculate_scenario_pnl(self.test_user, scenarios, seed)
+
+    def test_exact_best_and_worst_case(self):
+        result = self._run()
+
+        # cond1 pays 100 (yes) or 20 (no); cond2 pays 50 (no) or 0 (yes)
+        self.assertAlmostEqual(result['bestCase']['value'], 150.0, places=2)
+        self.assertAlmostEqual(result['worstCase']['value'], 20.0, places=2)
+        self.assertAlmostEqual(result['bestCase']['pnl'], 70.0, places=2)
+        self.assertAlmostEqual(result['expectedValue'], 0.6 * 100 + 0.4 * 20 + 0.5 * 50, places=2)
+        self.assertEqual(result['marketsCount'], 2)
+
+    def test_distribution_matches_expectation(self):
+        result = self._run(scenarios=50000)
+
+        self.assertAlmostEqual(result['distribution']['meanPnL'], result['expectedPnL'], delta=1.0)
+        self.assertLessEqual(result['distribution']['percentiles']['p1'], result['distribution']['percentiles']['p99'])
+        self.assertGreaterEqual(result['distribution']['percentiles']['p1'], result['worstCase']['pnl'])
+
+    def test_sector_breakdown(self):
+        result = self._run()
+        sectors = {s['sector']: s for s in result['sectors']}
+
+        self.assertEqual(set(sectors), {'Politics', 'Sports'})
+        self.assertAlmostEqual(sectors['Politics']['bestCase']['value'], 100.0, places=2)
+        self.assertAlmostEqual(sectors['Sports']['worstCase']['value'], 0.0, places=2)
+        self.assertAlmostEqual(sectors['Sports']['totalCost'], 20.0, places=2)
+
+    def test_chunking_does_not_change_results(self):
+        args = (['m1', 'm2', 'm3'], np.array([0, 0, 1]), np.array([10.0, 5.0, 8.0]),
+                np.array([0.3, 0.7, 0.2]), np.array([3.0, 3.5, 1.6]), np.array([3.0, 3.5, 1.6]), ['X', 'Y', 'X'])
+        whole = simulate_resolution_pnl(*args, scenarios=5000, seed=1)
+        chunked = simulate_resolution_pnl(*args, scenarios=5000, seed=1, chunk_elements=30)
+
+        self.assertEqual(whole['worstCase'], chunked['worstCase'])
+        self.assertAlmostEqual(whole['distribution']['meanPnL'], chunked['distribution']['meanPnL'], delta=0.5)
+
+    def test_api_error_handling(self):
+        with patch.object(self.api, 'get_user_positions', return_value={'error': 'API error', 'status_code': 500}):
+            result = self.api.calculate_scenario_pnl(self.test_user)
+
+        self.assertIn('error', result)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,134 @@
+import asyncio
+import contextvars
+import threading
+import time
+import unittest
+from unittest.mock import patch
+from fastapi.testclient import TestClient
+import main
+from scheduler import FairScheduler, SchedulerBusy, upstream_slot
+
+
+TEST_USER = "0x1234567890123456789012345678901234567890"
+
+
+class TestFairScheduler(unittest.IsolatedAsyncioTestCase):
+
+    async def test_round_robin_across_wallets(self):
+        scheduler = FairScheduler(max_active=1, max_active_per_wallet=1, max_wallet_queue=10)
+        order = []
+
+        def job(name):
+            time.sleep(0.01)
+            order.append(name)
+
+        # The whale queues three jobs before the small wallet's single job arrives
+        tasks = [asyncio.create_task(scheduler.run('whale', job, f'whale-{i}')) for i in range(3)]
+        await asyncio.sleep(0)
+        tasks.append(asyncio.create_task(scheduler.run('small', job, 'small-0')))
+        await asyncio.gather(*tasks)
+
+        self.assertLess(order.index('small-0'), order.index('whale-2'))
+
+    async def test_idle_scheduler_runs_one_wallets_fan_out_at_once(self):
+        # The dashboard sends six requests per wallet; none should wait on an idle server
+        scheduler = FairScheduler()
+        results = await asyncio.gather(*[scheduler.run(TEST_USER, time.sleep, 0.05) for _ in range(6)])
+
+        self.assertTrue(all(wait < 0.01 for _, wait in results))
+        self.assertEqual(scheduler.stats()['rejected'], 0)
+
+    async def test_whale_on_idle_scheduler_leaves_a_slot_for_newcomers(self):
+        # Kept within the default thread pool so every dispatched job gets a thread
+        scheduler = FairScheduler(max_active=4)
+        release = threading.Event()
+        self.addCleanup(release.set)
+        whale = [asyncio.create_task(scheduler.run('whale', release.wait, 5)) for _ in range(scheduler.max_active)]
+        await asyncio.sleep(0.01)
+
+        _, wait = await asyncio.wait_for(scheduler.run('small', time.sleep, 0.01), 1)
+        active = scheduler.stats()['active']
+        release.set()
+        await asyncio.gather(*whale)
+
+        self.assertLess(wait, 0.05)
+        self.assertEqual(active, scheduler.max_active - 1)
+
+    async def test_per_wallet_cap_applies_while_others_wait(self):
+        scheduler = FairScheduler(max_active=2, max_active_per_wallet=1)
+        order = []
+
+        def job(name):
+            time.sleep(0.02)
+            order.append(name)
+
+        tasks = [asyncio.create_task(scheduler.run('whale', job, f'whale-{i}')) for i in range(4)]
+        await asyncio.sleep(0)
+        tasks.append(asyncio.create_task(scheduler.run('small', job, 'small-0')))
+        await asyncio.gather(*tasks)
+
+        # The whale is held to its cap, so the small wallet is served before the whale's last job
+        self.assertLess(order.index('small-0'), order.index('whale-3'))
+
+    async def test_rejects_when_wallet_queue_is_full(self):
+        scheduler = FairScheduler(max_active=1, max_wallet_queue=1)
+        release = threading.Event()
+        running = asyncio.create_task(scheduler.run('whale', release.wait))
+        await asyncio.sleep(0)
+        queued = asyncio.create_task(scheduler.run('whale', lambda: None))
+        await asyncio.sleep(0)
+
+        with self.assertRaises(SchedulerBusy) as ctx:
+            await scheduler.run('whale', lambda: None)
+        self.assertGreaterEqual(ctx.exception.retry_after, 1)
+
+        release.set()
+        await asyncio.gather(running, queued)
+        self.assertEqual(scheduler.stats()['rejected'], 1)
+
+    async def test_caps_upstream_calls_per_request(self):
+        scheduler = FairScheduler(upstream_per_request=2)
+        lock = threading.Lock()
+        peak = [0, 0]
+
+        def call():
+            with upstream_slot():
+                with lock:
+                    peak[0] += 1
+                    peak[1] = max(peak[1], peak[0])
+                time.sleep(0.02)
+                with lock:
+                    peak[0] -= 1
+
+        def fan_out():
+            threads = [threading.Thread(target=contextvars.copy_context().run, args=(call,)) for _ in range(6)]
+            for t in threads:
+                t.start()
+            for t in threads:
+                t.join()
+
+        await scheduler.run(TEST_USER, fan_out)
+        self.assertEqual(peak[1], 2)
+
+
+class TestSchedulerRoutes(unittest.TestCase):
+
+    def test_queue_wait_header(self):
+        client = TestClient(main.app)
+        with patch('main.polymarket_api.get_user_value', return_value=[{'user': TEST_USER, 'value': 1.0}]):
+            response = client.get(f"/api/value?user={TEST_USER}")
+
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('X-Queue-Wait-Ms', response.headers)
+
+    def test_busy_returns_429_with_retry_after(self):
+        client = TestClient(main.app)
+        with patch.object(main.scheduler, 'run', side_effect=SchedulerBusy(7, 'busy')):
+            response = client.get(f"/api/positions?user={TEST_USER}")
+
+        self.assertEqual(response.status_code, 429)
+        self.assertEqual(response.headers['Retry-After'], '7')
+
+
+if __name__ == '__main__':
+    unittest.main()
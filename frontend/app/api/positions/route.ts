@@ -11,7 +11,7 @@ export async function GET(request: NextRequest) {
   }
 
   try {
-    const response = await fetch(`${BACKEND_URL}/api/positions?user=${user}`, {
+    const response = await fetch(`${BACKEND_URL}/api/positions?${searchParams.toString()}`, {
       headers: {
         'Accept': 'application/json',
       },